@@ -0,0 +1,128 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""dhcpprobe import time, memory and DISCOVER->OFFER latency.
+
+The latency is measured by Probe.measure on ifname while a minimal
+responder answers every DISCOVER with an OFFER on peer, the other end
+of a veth pair (needs root):
+
+    ip link add vtest0 type veth peer name vtest1
+    ip link set vtest0 up && ip link set vtest1 up
+    python benchmarks/bench_dhcpprobe.py [probes] [ifname] [peer]
+"""
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+
+import dhcpprobe
+
+
+def import_time(runs=5):
+    # cumulative microseconds of "import dhcpprobe" in a fresh interpreter
+    times = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import dhcpprobe"],
+            cwd=root,
+            capture_output=True,
+            text=True,
+        )
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == "dhcpprobe":
+                times.append(int(fields[1]))
+    return statistics.median(times)
+
+
+def offer_frame(discover, mac):
+    # OFFER from mac in the transaction of a DISCOVER frame
+    xid = int.from_bytes(
+        discover[dhcpprobe.XID_OFFSET : dhcpprobe.XID_OFFSET + 4], "big"
+    )
+    frame = bytearray(
+        dhcpprobe.client_frame(
+            mac,
+            xid,
+            bytes((dhcpprobe.OPTION_MESSAGE_TYPE, 1, dhcpprobe.OFFER))
+            + bytes((dhcpprobe.OPTION_SERVER_ID, 4))
+            + socket.inet_aton("10.99.0.1"),
+        )
+    )
+    frame[0:6] = discover[6:12]
+    frame[dhcpprobe.BOOTP_OFFSET] = 2
+    offered = dhcpprobe.BOOTP_OFFSET + 16
+    frame[offered : offered + 4] = socket.inet_aton("10.99.0.50")
+    return frame
+
+
+def respond(sock, mac, stop):
+    sock.settimeout(0.1)
+    while not stop.is_set():
+        try:
+            frame = sock.recv(2048)
+        except socket.timeout:
+            continue
+        if len(frame) > dhcpprobe.BOOTP_OFFSET and frame[dhcpprobe.BOOTP_OFFSET] == 1:
+            sock.send(offer_frame(frame, mac))
+
+
+def parse_cost(frames):
+    frame = offer_frame(
+        dhcpprobe.discover_template("02:00:00:00:00:01"), "02:00:00:00:00:02"
+    )
+    view = memoryview(frame)
+    start = time.perf_counter()
+    for _ in range(frames):
+        dhcpprobe.parse_reply(view, 0)
+    elapsed = time.perf_counter() - start
+    # allocations of one parse, timed without tracing
+    tracemalloc.start()
+    dhcpprobe.parse_reply(view, 0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed / frames, peak
+
+
+def main(probes=100, ifname="vtest0", peer="vtest1"):
+    probes = int(probes)
+    print("import dhcpprobe %8.0f us" % import_time())
+    per_frame, peak = parse_cost(10000)
+    print("parse_reply      %8.2f us  peak %d bytes" % (per_frame * 1e6, peak))
+    try:
+        responder = dhcpprobe.open_socket(peer)
+        tracemalloc.start()
+        probe = dhcpprobe.Probe(ifname)
+        footprint = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    except OSError as error:
+        print("no latency measurement on %s/%s: %s" % (ifname, peer, error))
+        return
+    print("Probe            %8d bytes" % footprint)
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=respond, args=(responder, dhcpprobe.interface_mac(peer), stop)
+    )
+    thread.start()
+    try:
+        (server,) = probe.measure(probes, window=0.05)
+    finally:
+        stop.set()
+        thread.join()
+        responder.close()
+    offer = server["offer"]
+    print(
+        "DISCOVER->OFFER  min %.3f  median %.3f  p99 %.3f ms, loss %.0f%%"
+        % (offer["min"], offer["median"], offer["p99"], offer["loss"] * 100)
+    )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
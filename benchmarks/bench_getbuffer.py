@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""EPD.getbuffer against the per-pixel loop it replaced.
+
+Runs on the virtual backend, so no panel is needed:
+
+    python benchmarks/bench_getbuffer.py [repeats]
+"""
+import os
+import sys
+import timeit
+
+os.environ.setdefault("EPD_BACKEND", "virtual")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import epd2in7
+from PIL import Image, ImageDraw, ImageFont
+
+
+def loop_getbuffer(epd, image):
+    # the original per-pixel implementation
+    buf = [0xFF] * (int(epd.width / 8) * epd.height)
+    image_monocolor = image.convert("1")
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    if imwidth == epd.width and imheight == epd.height:
+        for y in range(imheight):
+            for x in range(imwidth):
+                if pixels[x, y] == 0:
+                    buf[int((x + y * epd.width) / 8)] &= ~(0x80 >> (x % 8))
+    elif imwidth == epd.height and imheight == epd.width:
+        for y in range(imheight):
+            for x in range(imwidth):
+                newx = y
+                newy = epd.height - x - 1
+                if pixels[x, y] == 0:
+                    buf[int((newx + newy * epd.width) / 8)] &= ~(0x80 >> (y % 8))
+    return buf
+
+
+def sample(size):
+    image = Image.new("1", size, 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    for row in range(0, size[1], 12):
+        draw.text((2, row), "PTP offset %d ns" % (row * 37), font=font, fill=0)
+    draw.rectangle((size[0] // 2, 10, size[0] - 10, size[1] // 2), outline=0)
+    return image
+
+
+def main(repeats=20):
+    epd = epd2in7.EPD()
+    for name, size in (
+        ("Vertical", (epd.width, epd.height)),
+        ("Horizontal", (epd.height, epd.width)),
+    ):
+        image = sample(size)
+        if bytes(loop_getbuffer(epd, image)) != bytes(epd.getbuffer(image)):
+            sys.exit("%s: getbuffer output differs from the loop" % name)
+        loop = min(
+            timeit.repeat(lambda: loop_getbuffer(epd, image), number=1, repeat=repeats)
+        )
+        packed = min(
+            timeit.repeat(lambda: epd.getbuffer(image), number=1, repeat=repeats)
+        )
+        print(
+            "%-10s loop %8.3f ms  getbuffer %8.3f ms  x%.0f"
+            % (name, loop * 1000, packed * 1000, loop / packed)
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
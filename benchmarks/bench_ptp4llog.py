@@ -0,0 +1,39 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""ptp4l output parsing throughput of ptp4llog.LogReader.
+
+The five minute log in tests/data/ptp4l.log is repeated to the given
+number of hours of once-per-second servo output:
+
+    python benchmarks/bench_ptp4llog.py [hours]
+"""
+import io
+import os
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+
+import ptp4llog
+
+LOG = os.path.join(root, "tests", "data", "ptp4l.log")
+
+
+def main(hours=6):
+    with open(LOG) as log:
+        lines = log.read().splitlines(keepends=True)
+    samples = sum(1 for line in lines if "master offset" in line)
+    stream = io.StringIO("".join(lines * (hours * 3600 // samples + 1)))
+    reader = ptp4llog.LogReader(stream, lambda sample: None, lambda event: None)
+    start = time.perf_counter()
+    reader.run()
+    elapsed = time.perf_counter() - start
+    print(
+        "%d lines in %.0f ms, %.1f us per line"
+        % (reader.lines, elapsed * 1000, elapsed / reader.lines * 1e6)
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
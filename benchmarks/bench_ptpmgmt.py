@@ -0,0 +1,90 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""GET TIME_STATUS_NP latency: ManagementClient against a pmc subprocess.
+
+The client and pmc query the fake ptp4l socket from tests/fakeptp4l.py.
+Without pmc installed, printf stands in for it with pmc's output; a
+small C binary too, it pays the same fork/exec the client avoids:
+
+    python benchmarks/bench_ptpmgmt.py [queries]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [root, os.path.join(root, "tests")]
+
+import fakeptp4l
+import ptpmgmt
+
+PMC_OUTPUT = """sending: GET TIME_STATUS_NP
+\tb827eb.fffe.123456-0 seq 0 RESPONSE MANAGEMENT TIME_STATUS_NP
+\t\tmaster_offset              -12
+\t\tingress_time               1700000000123456789
+\t\tcumulativeScaledRateOffset +0.000000000
+\t\tscaledLastGmPhaseChange    0
+\t\tgmTimeBaseIndicator        0
+\t\tlastGmPhaseChange          0x0000'0000000000000000.0000
+\t\tgmPresent                  true
+\t\tgmIdentity                 001122.fffe.334455
+"""
+
+
+def pmc_command(server_path):
+    if shutil.which("pmc"):
+        return ["pmc", "-u", "-s", server_path, "-b", "0", "GET TIME_STATUS_NP"]
+    return ["printf", "%s", PMC_OUTPUT]
+
+
+def pmc_time_status(command):
+    # what get_ptp_info did with pmc's output
+    result = subprocess.run(command, capture_output=True, text=True)
+    offset = ingress_time = None
+    for line in result.stdout.split("\n"):
+        if "ingress_time" in line:
+            ingress_time = int(line.split()[-1])
+        if "master_offset" in line:
+            offset = int(line.split()[-1])
+    return offset, ingress_time
+
+
+def per_query(function, queries):
+    start = time.perf_counter()
+    for _ in range(queries):
+        function()
+    return (time.perf_counter() - start) / queries
+
+
+def main(queries=200):
+    directory = tempfile.mkdtemp()
+    ptp4l = fakeptp4l.FakePtp4l(os.path.join(directory, "ptp4l"))
+    client = ptpmgmt.ManagementClient(ptp4l.path)
+    client.client_path = os.path.join(directory, "pmc-py")
+    command = pmc_command(ptp4l.path)
+    try:
+        status = client.time_status()
+        if pmc_time_status(command) != (status.master_offset, status.ingress_time):
+            sys.exit("the subprocess path read a different status")
+        native = per_query(client.time_status, queries)
+        spawned = per_query(lambda: pmc_time_status(command), max(1, queries // 10))
+    finally:
+        client.close()
+        ptp4l.close()
+        os.rmdir(directory)
+    print(
+        "ManagementClient %8.1f us  %s %8.1f us  x%.0f"
+        % (
+            native * 1e6,
+            "pmc" if command[0] == "pmc" else "pmc stand-in",
+            spawned * 1e6,
+            spawned / native,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
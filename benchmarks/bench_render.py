@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Render time per e-paper view: draw_view against a single draw.text.
+
+The views and the single draw.text rendering come from
+tests/test_epdview.py. "cold" is draw_view with empty caches, on a
+view's first frame or after the label or caption set changed:
+
+    python benchmarks/bench_render.py [frames]
+"""
+import os
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [root, os.path.join(root, "tests")]
+os.environ.setdefault("EPD_BACKEND", "virtual")
+
+import epdview
+import test_epdview
+
+
+def per_frame(function, frames):
+    start = time.perf_counter()
+    for _ in range(frames):
+        function()
+    return (time.perf_counter() - start) / frames
+
+
+def cold(view):
+    epdview.label_strip.cache_clear()
+    epdview.view_template.cache_clear()
+    epdview.draw_view(*view)
+
+
+def main(frames=500):
+    views = {
+        "dhcp " + name: epdview.dhcp_view(*args)
+        for name, args in test_epdview.DHCP_VIEWS.items()
+    }
+    views.update(
+        ("ptp " + name, epdview.ptp_view(*args))
+        for name, args in test_epdview.PTP_VIEWS.items()
+    )
+    print("%-28s %10s %10s %10s" % ("view", "draw.text", "cold", "draw_view"))
+    for name, view in views.items():
+        single = per_frame(lambda: test_epdview.single_text(*view), frames)
+        first = per_frame(lambda: cold(view), max(1, frames // 10))
+        cached = per_frame(lambda: epdview.draw_view(*view), frames)
+        print(
+            "%-28s %7.0f us %7.0f us %7.0f us"
+            % (name, single * 1e6, first * 1e6, cached * 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,405 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""DHCP probe and monitor on raw AF_PACKET sockets.
+
+Broadcasts DISCOVERs and reads the OFFER/ACK answers of every server on
+the link using only the standard library. The DISCOVER
+is built once and only its transaction id is patched for each probe;
+replies are received into a preallocated buffer and parsed in place
+through a memoryview. A classic BPF filter keeps everything but DHCP in
+the kernel.
+"""
+import ctypes
+import logging
+import math
+import os
+import socket
+import statistics
+import struct
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+ETH_P_IP = 0x0800
+SO_ATTACH_FILTER = 26
+SO_TIMESTAMPNS = 35
+# struct timespec of the receive timestamp
+TIMESPEC = struct.Struct("ll")
+
+# DHCP message types (option 53)
+DISCOVER = 1
+OFFER = 2
+REQUEST = 3
+ACK = 5
+NAK = 6
+
+OPTION_PAD = 0
+OPTION_SUBNET_MASK = 1
+OPTION_REQUESTED_IP = 50
+OPTION_MESSAGE_TYPE = 53
+OPTION_SERVER_ID = 54
+OPTION_END = 255
+MAGIC_COOKIE = b"\x63\x82\x53\x63"
+
+ETHERNET = struct.Struct(">6s6sH")
+# version/IHL, TOS, total length, id, flags/fragment offset, TTL, protocol,
+# checksum, source, destination
+IPV4 = struct.Struct(">BBHHHBBH4s4s")
+UDP = struct.Struct(">HHHH")
+# op, htype, hlen, hops, xid, secs, flags, ciaddr, yiaddr, siaddr, giaddr,
+# chaddr, sname, file
+BOOTP = struct.Struct(">BBBBIHH4s4s4s4s16s64s128s")
+BOOTP_OFFSET = ETHERNET.size + IPV4.size + UDP.size
+XID_OFFSET = BOOTP_OFFSET + 4
+# servers may drop BOOTP messages shorter than this (RFC 1542)
+BOOTP_MIN_SIZE = 300
+
+# udp and (port 67 or port 68), unfragmented IPv4 only
+DHCP_FILTER = (
+    (0x28, 0, 0, 12),  # ldh [12]
+    (0x15, 0, 12, ETH_P_IP),  # jeq #0x800
+    (0x30, 0, 0, 23),  # ldb [23]
+    (0x15, 0, 10, socket.IPPROTO_UDP),  # jeq #17
+    (0x28, 0, 0, 20),  # ldh [20]
+    (0x45, 8, 0, 0x1FFF),  # jset #0x1fff, fragment
+    (0xB1, 0, 0, 14),  # ldxb 4*([14]&0xf)
+    (0x48, 0, 0, 14),  # ldh [x + 14], source port
+    (0x15, 4, 0, 67),  # jeq #67
+    (0x15, 3, 0, 68),  # jeq #68
+    (0x48, 0, 0, 16),  # ldh [x + 16], destination port
+    (0x15, 1, 0, 67),  # jeq #67
+    (0x15, 0, 1, 68),  # jeq #68
+    (0x06, 0, 0, 0x40000),  # ret #262144
+    (0x06, 0, 0, 0),  # ret #0
+)
+
+
+@dataclass(frozen=True)
+class Reply:
+    received: int  # kernel receive timestamp, ns since the epoch
+    message_type: int
+    xid: int
+    server_ip: str  # server identifier, the IP source without one
+    server_mac: str
+    offered_ip: str
+    subnet_mask: str
+
+
+def interface_mac(ifname):
+    with open("/sys/class/net/%s/address" % ifname) as address:
+        return address.read().strip()
+
+
+def ip_checksum(header):
+    total = sum(struct.unpack(">%dH" % (len(header) // 2), header))
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+    return ~total & 0xFFFF
+
+
+def client_frame(mac, xid, options):
+    """Broadcast BOOTREQUEST frame from mac carrying the encoded options."""
+    chaddr = bytes.fromhex(mac.replace(":", ""))
+    bootp = BOOTP.pack(
+        1, 1, 6, 0, xid, 0, 0, bytes(4), bytes(4), bytes(4), bytes(4), chaddr, b"", b""
+    )
+    bootp += MAGIC_COOKIE + options + bytes((OPTION_END,))
+    bootp += bytes(max(0, BOOTP_MIN_SIZE - len(bootp)))
+    udp = UDP.pack(68, 67, UDP.size + len(bootp), 0)
+    ip = IPV4.pack(
+        0x45,
+        0,
+        IPV4.size + len(udp) + len(bootp),
+        0,
+        0,
+        64,
+        socket.IPPROTO_UDP,
+        0,
+        bytes(4),
+        b"\xff" * 4,
+    )
+    # the transaction id is in the UDP payload, so this checksum holds for
+    # every probe; a zero UDP checksum means none
+    ip = ip[:10] + struct.pack(">H", ip_checksum(ip)) + ip[12:]
+    ethernet = ETHERNET.pack(b"\xff" * 6, chaddr, ETH_P_IP)
+    return ethernet + ip + udp + bootp
+
+
+def discover_template(mac):
+    """DISCOVER frame from mac with a zero transaction id."""
+    return client_frame(mac, 0, bytes((OPTION_MESSAGE_TYPE, 1, DISCOVER)))
+
+
+def request_frame(mac, offer):
+    """REQUEST selecting offer, in the transaction of its DISCOVER."""
+    return client_frame(
+        mac,
+        offer.xid,
+        bytes((OPTION_MESSAGE_TYPE, 1, REQUEST, OPTION_REQUESTED_IP, 4))
+        + socket.inet_aton(offer.offered_ip)
+        + bytes((OPTION_SERVER_ID, 4))
+        + socket.inet_aton(offer.server_ip),
+    )
+
+
+def latency_summary(latencies, attempts):
+    """min/median/p99 in ms and the share of attempts left unanswered."""
+    if not attempts:
+        return None
+    latencies = sorted(latencies)
+    n = len(latencies)
+    summary = {"min": None, "median": None, "p99": None}
+    if n:
+        summary = {
+            "min": round(latencies[0], 3),
+            "median": round(statistics.median(latencies), 3),
+            # nearest rank
+            "p99": round(latencies[math.ceil(0.99 * n) - 1], 3),
+        }
+    summary.update({"samples": n, "loss": round(1 - n / attempts, 3)})
+    return summary
+
+
+def parse_reply(frame, received):
+    """Reply for a BOOTREPLY frame carrying option 53, None otherwise."""
+    if len(frame) < BOOTP_OFFSET + BOOTP.size + len(MAGIC_COOKIE):
+        return None
+    bootp = ETHERNET.size + (frame[ETHERNET.size] & 0x0F) * 4 + UDP.size
+    options = bootp + BOOTP.size + len(MAGIC_COOKIE)
+    if (
+        frame[bootp] != 2
+        or len(frame) < options
+        or frame[options - len(MAGIC_COOKIE) : options] != MAGIC_COOKIE
+    ):
+        return None
+    message_type = server_id = subnet_mask = None
+    end = len(frame)
+    while options < end:
+        code = frame[options]
+        if code == OPTION_PAD:
+            options += 1
+            continue
+        if code == OPTION_END or options + 2 > end:
+            break
+        length = frame[options + 1]
+        value = frame[options + 2 : options + 2 + length]
+        options += 2 + length
+        if len(value) != length:
+            break
+        if code == OPTION_MESSAGE_TYPE and length == 1:
+            message_type = value[0]
+        elif code == OPTION_SERVER_ID and length == 4:
+            server_id = socket.inet_ntoa(value)
+        elif code == OPTION_SUBNET_MASK and length == 4:
+            subnet_mask = socket.inet_ntoa(value)
+    if message_type is None:
+        return None
+    return Reply(
+        received,
+        message_type,
+        int.from_bytes(frame[bootp + 4 : bootp + 8], "big"),
+        server_id or socket.inet_ntoa(frame[26:30]),
+        frame[6:12].hex(":"),
+        socket.inet_ntoa(frame[bootp + 16 : bootp + 20]),
+        subnet_mask,
+    )
+
+
+def open_socket(ifname):
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_IP))
+    # struct sock_fprog points at the instructions, which only have to live
+    # until setsockopt has copied them into the kernel
+    program = ctypes.create_string_buffer(
+        b"".join(struct.pack("HBBI", *instruction) for instruction in DHCP_FILTER)
+    )
+    sock.setsockopt(
+        socket.SOL_SOCKET,
+        SO_ATTACH_FILTER,
+        struct.pack("HP", len(DHCP_FILTER), ctypes.addressof(program)),
+    )
+    sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    sock.bind((ifname, ETH_P_IP))
+    return sock
+
+
+def receive_time(ancillary):
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS:
+            seconds, nanoseconds = TIMESPEC.unpack_from(data)
+            return seconds * 1_000_000_000 + nanoseconds
+    return time.time_ns()
+
+
+def receive(sock, buffer, timeout):
+    """Next incoming DHCP reply within timeout, None when it runs out."""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        sock.settimeout(remaining)
+        try:
+            length, ancillary, _, address = sock.recvmsg_into(
+                [buffer], socket.CMSG_SPACE(TIMESPEC.size)
+            )
+        except socket.timeout:
+            return None
+        # frames sent from this host, including our own DHCP server's
+        if address[2] == socket.PACKET_OUTGOING:
+            continue
+        reply = parse_reply(memoryview(buffer)[:length], receive_time(ancillary))
+        if reply:
+            return reply
+
+
+class Probe:
+    """Sends DISCOVERs on one interface and collects the OFFERs."""
+
+    def __init__(self, ifname="eth0"):
+        self.ifname = ifname
+        self.mac = interface_mac(ifname)
+        self.template = bytearray(discover_template(self.mac))
+        self.buffer = bytearray(2048)
+        self.lock = threading.Lock()
+
+    def discover(self, window=1.0, retries=2, backoff=2.0):
+        """Broadcast a DISCOVER and return one OFFER per answering server.
+
+        Offers are collected for the whole window. Without any, the
+        DISCOVER is repeated up to retries times, each time with the
+        window multiplied by backoff.
+        """
+        with self.lock:
+            sock = open_socket(self.ifname)
+            try:
+                for attempt in range(retries + 1):
+                    xid, sent = self.send_discover(sock)
+                    offers = self.collect(sock, xid, window, (OFFER,))
+                    if offers:
+                        return list(offers.values())
+                    window *= backoff
+                return []
+            finally:
+                sock.close()
+
+    def measure(self, count=10, request=False, window=1.0):
+        """Time count DISCOVER exchanges, and REQUESTs for the offers.
+
+        Every exchange has its own transaction id and waits the whole
+        window for the OFFERs; with request set each offer is then
+        requested and the ACK (or NAK) awaited. That takes a lease from
+        every server. Returns per server the DISCOVER->OFFER and
+        REQUEST->ACK latency summaries, from the send time to the
+        kernel receive timestamp.
+        """
+        offers = {}
+        acks = {}
+        requests = {}
+        with self.lock:
+            sock = open_socket(self.ifname)
+            try:
+                for exchange in range(count):
+                    xid, sent = self.send_discover(sock)
+                    replies = self.collect(sock, xid, window, (OFFER,))
+                    for server, offer in replies.items():
+                        offers.setdefault(server, []).append(
+                            (offer.received - sent) / 1e6
+                        )
+                        if not request:
+                            continue
+                        requests[server] = requests.get(server, 0) + 1
+                        latency = self.request(sock, offer, window)
+                        if latency is not None:
+                            acks.setdefault(server, []).append(latency)
+            finally:
+                sock.close()
+        return [
+            {
+                "server_ip": server[0],
+                "server_mac": server[1],
+                "offer": latency_summary(latencies, count),
+                "ack": latency_summary(acks.get(server, []), requests.get(server)),
+            }
+            for server, latencies in offers.items()
+        ]
+
+    def send_discover(self, sock):
+        xid = int.from_bytes(os.urandom(4), "big")
+        self.template[XID_OFFSET : XID_OFFSET + 4] = xid.to_bytes(4, "big")
+        sent = time.time_ns()
+        sock.send(self.template)
+        return xid, sent
+
+    def request(self, sock, offer, window):
+        # REQUEST->ACK (or NAK) latency in ms, None without an answer
+        server = (offer.server_ip, offer.server_mac)
+        sent = time.time_ns()
+        sock.send(request_frame(self.mac, offer))
+        reply = self.collect(sock, offer.xid, window, (ACK, NAK), server).get(server)
+        if reply is None:
+            return None
+        return (reply.received - sent) / 1e6
+
+    def collect(self, sock, xid, window, message_types, server=None):
+        # first reply of each server in the transaction, or only server's
+        replies = {}
+        deadline = time.monotonic() + window
+        while True:
+            reply = receive(sock, self.buffer, deadline - time.monotonic())
+            if reply is None:
+                return replies
+            if reply.xid != xid or reply.message_type not in message_types:
+                continue
+            key = (reply.server_ip, reply.server_mac)
+            if server is None:
+                replies.setdefault(key, reply)
+            elif key == server:
+                return {key: reply}
+
+
+class Monitor:
+    """Hands every OFFER and ACK seen on the interface to on_reply.
+
+    Runs on a daemon thread; frames sent by this host are skipped.
+    """
+
+    def __init__(self, ifname, on_reply, retry_interval=5):
+        self.ifname = ifname
+        self.on_reply = on_reply
+        # seconds between attempts to reopen the socket after an error
+        self.retry_interval = retry_interval
+        self.buffer = bytearray(2048)
+        self.replies = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        sock = None
+        while True:
+            try:
+                if sock is None:
+                    sock = open_socket(self.ifname)
+                reply = receive(sock, self.buffer, 60)
+            except OSError as error:
+                # e.g. ENETDOWN while the interface goes down, or ENODEV
+                # before it is back
+                self.errors += 1
+                logger.warning("DHCP monitor on %s: %s, reopening", self.ifname, error)
+                if sock is not None:
+                    sock.close()
+                    sock = None
+                time.sleep(self.retry_interval)
+                continue
+            if reply is None or reply.message_type not in (OFFER, ACK):
+                continue
+            self.replies += 1
+            try:
+                self.on_reply(reply)
+            except Exception:
+                logger.exception("handling a DHCP reply failed")
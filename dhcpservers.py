@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Table of the DHCP servers seen answering on the network.
+
+Servers are keyed by (IP, MAC), so two servers sharing an address are
+still told apart, and updated in place from every OFFER or ACK.
+"""
+import ipaddress
+import threading
+from dataclasses import asdict, dataclass
+
+from dhcpprobe import ACK, OFFER
+
+
+@dataclass
+class DhcpServer:
+    ip: str
+    mac: str
+    first_seen: float
+    last_seen: float
+    offered_ip: str = None
+    offered_subnet: str = None
+    offers: int = 0
+    acks: int = 0
+
+
+def offered_subnet(offered_ip, subnet_mask):
+    # e.g. 192.168.1.0/24, None without a usable subnet mask option
+    if not offered_ip or not subnet_mask:
+        return None
+    try:
+        return str(ipaddress.ip_network(offered_ip + "/" + subnet_mask, strict=False))
+    except ValueError:
+        return None
+
+
+class ServerTable:
+    def __init__(self):
+        self.servers = {}
+        # (xid, message type) of each server's last reply
+        self.transactions = {}
+        self.lock = threading.Lock()
+
+    def update(self, ip, mac, message_type, offered_ip, subnet_mask, now, xid=None):
+        """Record an OFFER or ACK; True if the server was not known yet.
+
+        A reply seen again with the same xid and type, as handed over by
+        both the monitor and a scan, only refreshes last_seen.
+        """
+        with self.lock:
+            server = self.servers.get((ip, mac))
+            new = server is None
+            if new:
+                server = self.servers[(ip, mac)] = DhcpServer(ip, mac, now, now)
+            transaction = (xid, message_type)
+            repeated = (
+                xid is not None and self.transactions.get((ip, mac)) == transaction
+            )
+            self.transactions[(ip, mac)] = transaction
+            server.last_seen = now
+            if offered_ip and offered_ip != "0.0.0.0":
+                if offered_ip != server.offered_ip or not server.offered_subnet:
+                    server.offered_subnet = (
+                        offered_subnet(offered_ip, subnet_mask) or server.offered_subnet
+                    )
+                server.offered_ip = offered_ip
+            if repeated:
+                return new
+            if message_type == OFFER:
+                server.offers += 1
+            elif message_type == ACK:
+                server.acks += 1
+            return new
+
+    def expire(self, before):
+        with self.lock:
+            for key, server in list(self.servers.items()):
+                if server.last_seen < before:
+                    del self.servers[key]
+                    self.transactions.pop(key, None)
+
+    def latest(self):
+        # IP of the server heard from most recently, None if there is none
+        with self.lock:
+            if not self.servers:
+                return None
+            return max(self.servers.values(), key=lambda s: s.last_seen).ip
+
+    def snapshot(self):
+        with self.lock:
+            return [asdict(server) for server in self.servers.values()]
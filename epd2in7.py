@@ -28,6 +28,7 @@
 #
 
 import logging
+import time
 import epdconfig
 
 # Display resolution
@@ -39,6 +40,28 @@ GRAY2  = 0xC0
 GRAY3  = 0x80 #gray
 GRAY4  = 0x00 #Blackest
 
+# Give up on a refresh the panel has not finished after this many seconds
+BUSY_TIMEOUT = 30
+# Upper bounds (ms) of the busy duration histogram buckets
+BUSY_BUCKETS_MS = [50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+# 4 gray translation tables, indexed by byte value
+# 'L' level -> 2 bit gray code, GRAY2 and GRAY3 are moved down one step first
+GRAY_CODE = bytes((0x80 if v == GRAY2 else 0x40 if v == GRAY3 else v) >> 6 for v in range(256))
+# gray code -> the code at pixel n (MSB first) of a 4 pixel byte
+GRAY_PACK = [bytes((v & 0x03) << (6 - 2 * n) for v in range(256)) for n in range(4)]
+# 4 pixel byte -> its 4 bits of the 0x10 (high bit of each code) or 0x13
+# (low bit of each code) plane, as the upper or lower nibble of the plane byte
+GRAY_PLANE1 = [bytes(sum(((v >> (7 - 2 * k)) & 1) << (3 - k) for k in range(4)) << shift for v in range(256)) for shift in (4, 0)]
+GRAY_PLANE2 = [bytes(sum(((v >> (6 - 2 * k)) & 1) << (3 - k) for k in range(4)) << shift for v in range(256)) for shift in (4, 0)]
+
+def merge_bytes(parts):
+    # bitwise OR of equally long byte strings
+    merged = 0
+    for part in parts:
+        merged |= int.from_bytes(part, 'big')
+    return merged.to_bytes(len(parts[0]), 'big')
+
 logger = logging.getLogger(__name__)
 
 class EPD:
@@ -53,6 +76,9 @@ class EPD:
         self.GRAY2  = GRAY2
         self.GRAY3  = GRAY3 #gray
         self.GRAY4  = GRAY4 #Blackest
+        self.frame_counters = {"calls": 0, "bytes": 0}
+        self.busy_counts = [0] * (len(BUSY_BUCKETS_MS) + 1)
+        self.last_busy_ms = None
 
     lut_vcom_dc = [0x00, 0x00,
         0x00, 0x08, 0x00, 0x00, 0x00, 0x02,
@@ -151,6 +177,68 @@ class EPD:
     0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
     0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
     ]
+
+    ###################command/payload tables######################
+    # Each entry is (command, payload); the payload goes out as one SPI burst
+    lut_sequence = [
+        (0x20, bytes(lut_vcom_dc)), # vcom
+        (0x21, bytes(lut_ww)),      # ww --
+        (0x22, bytes(lut_bw)),      # bw r
+        (0x23, bytes(lut_bb)),      # wb w
+        (0x24, bytes(lut_wb)),      # bb b
+    ]
+    gray_lut_sequence = [
+        (0x20, bytes(gray_lut_vcom)), # vcom
+        (0x21, bytes(gray_lut_ww)),   # red not use
+        (0x22, bytes(gray_lut_bw)),   # bw r
+        (0x23, bytes(gray_lut_wb)),   # wb w
+        (0x24, bytes(gray_lut_bb)),   # bb b
+        (0x25, bytes(gray_lut_ww)),   # vcom
+    ]
+    # Sent before POWER_ON
+    power_sequence = [
+        (0x01, bytes([0x03, 0x00, 0x2b, 0x2b, 0x09])), # POWER_SETTING: VDS_EN VDG_EN, VCOM_HV VGHL_LV, VDH, VDL, VDHR
+        (0x06, bytes([0x07, 0x07, 0x17])),             # BOOSTER_SOFT_START
+        (0xF8, bytes([0x60, 0xA5])),                   # Power optimization
+        (0xF8, bytes([0x89, 0xA5])),
+        (0xF8, bytes([0x90, 0x00])),
+        (0xF8, bytes([0x93, 0x2A])),
+        (0xF8, bytes([0xA0, 0xA5])),
+        (0xF8, bytes([0xA1, 0x00])),
+        (0xF8, bytes([0x73, 0x41])),
+        (0x16, bytes([0x00])),                         # PARTIAL_DISPLAY_REFRESH
+    ]
+    # Sent after POWER_ON, followed by the LUTs
+    panel_sequence = [
+        (0x00, bytes([0xAF])), # PANEL_SETTING: KW-BF   KWR-AF    BWROTP 0f
+        (0x30, bytes([0x3A])), # PLL_CONTROL: 3A 100HZ   29 150Hz 39 200HZ    31 171HZ
+        (0x50, bytes([0x57])), # VCOM AND DATA INTERVAL SETTING
+        (0x82, bytes([0x12])), # VCM_DC_SETTING_REGISTER
+    ]
+    gray_power_sequence = [
+        (0x01, bytes([0x03, 0x00, 0x2b, 0x2b])), # POWER SETTING
+        (0x06, bytes([0x07, 0x07, 0x17])),       # booster soft start A, B, C
+        (0xF8, bytes([0x60, 0xA5])),             # boost??
+        (0xF8, bytes([0x89, 0xA5])),
+        (0xF8, bytes([0x90, 0x00])),
+        (0xF8, bytes([0x93, 0x2A])),
+        (0xF8, bytes([0xa0, 0xa5])),
+        (0xF8, bytes([0xa1, 0x00])),
+        (0xF8, bytes([0x73, 0x41])),
+        (0x16, bytes([0x00])),
+    ]
+    gray_panel_sequence = [
+        (0x00, bytes([0xbf])),                   # panel setting: KW-BF   KWR-AF	BWROTP 0f
+        (0x30, bytes([0x90])),                   # PLL setting: 100hz
+        (0x61, bytes([0x00, 0xb0, 0x01, 0x08])), # resolution setting: 176, 264
+        (0x82, bytes([0x12])),                   # vcom_DC setting
+        (0x50, bytes([0x57])),                   # VCOM AND DATA INTERVAL SETTING
+    ]
+    sleep_sequence = [
+        (0x50, bytes([0xf7])),
+        (0x02, b''),           # POWER_OFF
+        (0x07, bytes([0xA5])), # DEEP_SLEEP
+    ]
     
     # Hardware reset
     def reset(self):
@@ -172,54 +260,43 @@ class EPD:
         epdconfig.digital_write(self.cs_pin, 0)
         epdconfig.spi_writebyte([data])
         epdconfig.digital_write(self.cs_pin, 1)
+
+    # send a whole block of data with DC set once
+    def send_data2(self, data):
+        epdconfig.digital_write(self.dc_pin, 1)
+        epdconfig.digital_write(self.cs_pin, 0)
+        epdconfig.spi_writebyte2(data)
+        epdconfig.digital_write(self.cs_pin, 1)
+
+    def send_sequence(self, sequence):
+        for command, payload in sequence:
+            self.send_command(command)
+            if payload:
+                self.send_data2(payload)
         
-    def ReadBusy(self):        
+    def ReadBusy(self, timeout=BUSY_TIMEOUT):
         logger.debug("e-Paper busy")
-        while(epdconfig.digital_read(self.busy_pin) == 0):      #  0: idle, 1: busy
-            epdconfig.delay_ms(200)                
-        logger.debug("e-Paper busy release")
+        start = time.monotonic()
+        #  0: busy, 1: idle; wait for the rising edge instead of polling
+        if not epdconfig.digital_wait(self.busy_pin, 1, timeout):
+            logger.error("e-Paper still busy after %d s", timeout)
+            raise TimeoutError("e-Paper busy for more than %d s" % timeout)
+        self.last_busy_ms = (time.monotonic() - start) * 1000
+        bucket = 0
+        while bucket < len(BUSY_BUCKETS_MS) and self.last_busy_ms > BUSY_BUCKETS_MS[bucket]:
+            bucket += 1
+        self.busy_counts[bucket] += 1
+        logger.debug("e-Paper busy release after %d ms", self.last_busy_ms)
+
+    def busy_histogram(self):
+        labels = ["<=%d" % limit for limit in BUSY_BUCKETS_MS] + [">%d" % BUSY_BUCKETS_MS[-1]]
+        return dict(zip(labels, self.busy_counts))
 
     def set_lut(self):
-        self.send_command(0x20) # vcom
-        for count in range(0, 44):
-            self.send_data(self.lut_vcom_dc[count])
-        self.send_command(0x21) # ww --
-        for count in range(0, 42):
-            self.send_data(self.lut_ww[count])
-        self.send_command(0x22) # bw r
-        for count in range(0, 42):
-            self.send_data(self.lut_bw[count])
-        self.send_command(0x23) # wb w
-        for count in range(0, 42):
-            self.send_data(self.lut_bb[count])
-        self.send_command(0x24) # bb b
-        for count in range(0, 42):
-            self.send_data(self.lut_wb[count])
+        self.send_sequence(self.lut_sequence)
             
     def gray_SetLut(self):
-        self.send_command(0x20)
-        for count in range(0, 44):        #vcom
-            self.send_data(self.gray_lut_vcom[count])
-            
-        self.send_command(0x21)							#red not use
-        for count in range(0, 42): 
-            self.send_data(self.gray_lut_ww[count])
-
-        self.send_command(0x22)							#bw r
-        for count in range(0, 42): 
-            self.send_data(self.gray_lut_bw[count])
-
-        self.send_command(0x23)							#wb w
-        for count in range(0, 42): 
-            self.send_data(self.gray_lut_wb[count])
-
-        self.send_command(0x24)							#bb b
-        for count in range(0, 42): 
-            self.send_data(self.gray_lut_bb[count])
-
-        self.send_command(0x25)							#vcom
-        for count in range(0, 42): 
-            self.send_data(self.gray_lut_ww[count])
+        self.send_sequence(self.gray_lut_sequence)
     
     def init(self):
         if (epdconfig.module_init() != 0):
@@ -228,69 +305,11 @@ class EPD:
         # EPD hardware init start
         self.reset()
         
-        self.send_command(0x01) # POWER_SETTING
-        self.send_data(0x03) # VDS_EN, VDG_EN
-        self.send_data(0x00) # VCOM_HV, VGHL_LV[1], VGHL_LV[0]
-        self.send_data(0x2b) # VDH
-        self.send_data(0x2b) # VDL
-        self.send_data(0x09) # VDHR
-        
-        self.send_command(0x06) # BOOSTER_SOFT_START
-        self.send_data(0x07)
-        self.send_data(0x07)
-        self.send_data(0x17)
-        
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x60)
-        self.send_data(0xA5)
-        
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x89)
-        self.send_data(0xA5)
-        
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x90)
-        self.send_data(0x00)
-        
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x93)
-        self.send_data(0x2A)
-        
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0xA0)
-        self.send_data(0xA5)
-        
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0xA1)
-        self.send_data(0x00)
-        
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x73)
-        self.send_data(0x41)
-        
-        self.send_command(0x16) # PARTIAL_DISPLAY_REFRESH
-        self.send_data(0x00)
+        self.send_sequence(self.power_sequence)
         self.send_command(0x04) # POWER_ON
         self.ReadBusy()
 
-        self.send_command(0x00) # PANEL_SETTING
-        self.send_data(0xAF) # KW-BF   KWR-AF    BWROTP 0f
-        
-        self.send_command(0x30) # PLL_CONTROL
-        self.send_data(0x3A) # 3A 100HZ   29 150Hz 39 200HZ    31 171HZ
-    
-        self.send_command(0X50)			#VCOM AND DATA INTERVAL SETTING			
-        self.send_data(0x57)
-        
-        self.send_command(0x82) # VCM_DC_SETTING_REGISTER
-        self.send_data(0x12)
+        self.send_sequence(self.panel_sequence)
         self.set_lut()
         return 0
 
@@ -299,204 +318,91 @@ class EPD:
             return -1
         self.reset()
         
-        self.send_command(0x01)			#POWER SETTING
-        self.send_data (0x03)
-        self.send_data (0x00)    
-        self.send_data (0x2b)															 
-        self.send_data (0x2b)		
-
-
-        self.send_command(0x06)         #booster soft start
-        self.send_data (0x07)		#A
-        self.send_data (0x07)		#B
-        self.send_data (0x17)		#C 
-
-        self.send_command(0xF8)         #boost??
-        self.send_data (0x60)
-        self.send_data (0xA5)
-
-        self.send_command(0xF8)         #boost??
-        self.send_data (0x89)
-        self.send_data (0xA5)
-
-        self.send_command(0xF8)         #boost??
-        self.send_data (0x90)
-        self.send_data (0x00)
-
-        self.send_command(0xF8)         #boost??
-        self.send_data (0x93)
-        self.send_data (0x2A)
-
-        self.send_command(0xF8)         #boost??
-        self.send_data (0xa0)
-        self.send_data (0xa5)
-
-        self.send_command(0xF8)         #boost??
-        self.send_data (0xa1)
-        self.send_data (0x00)
-
-        self.send_command(0xF8)         #boost??
-        self.send_data (0x73)
-        self.send_data (0x41)
-
-        self.send_command(0x16)
-        self.send_data(0x00)	
-
+        self.send_sequence(self.gray_power_sequence)
         self.send_command(0x04)
         self.ReadBusy()
 
-        self.send_command(0x00)			#panel setting
-        self.send_data(0xbf)		#KW-BF   KWR-AF	BWROTP 0f
-
-        self.send_command(0x30)			#PLL setting
-        self.send_data (0x90)      	#100hz 
-
-        self.send_command(0x61)			#resolution setting
-        self.send_data (0x00)		#176
-        self.send_data (0xb0)     	 
-        self.send_data (0x01)		#264
-        self.send_data (0x08)
-
-        self.send_command(0x82)			#vcom_DC setting
-        self.send_data (0x12)
-
-        self.send_command(0X50)			#VCOM AND DATA INTERVAL SETTING			
-        self.send_data(0x57)
+        self.send_sequence(self.gray_panel_sequence)
 
     def getbuffer(self, image):
         # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width/8) * self.height)
         image_monocolor = image.convert('1')
         imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
         # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
         if(imwidth == self.width and imheight == self.height):
             logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if pixels[x, y] == 0:
-                        buf[int((x + y * self.width) / 8)] &= ~(0x80 >> (x % 8))
         elif(imwidth == self.height and imheight == self.width):
             logger.debug("Horizontal")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    newx = y
-                    newy = self.height - x - 1
-                    if pixels[x, y] == 0:
-                        buf[int((newx + newy*self.width) / 8)] &= ~(0x80 >> (y % 8))
-        return buf
+            # Pixel (x, y) lands on (y, height - x - 1), i.e. a 90 degree
+            # counter-clockwise turn into the panel's native orientation.
+            image_monocolor = image_monocolor.rotate(90, expand=True)
+        else:
+            return bytearray([0xFF] * (int(self.width/8) * self.height))
+        # Mode '1' rows are already packed MSB first with 1 = white, which is
+        # exactly the panel's frame layout (width is a multiple of 8).
+        return bytearray(image_monocolor.tobytes('raw', '1'))
     
     def getbuffer_4Gray(self, image):
         # logger.debug("bufsiz = ",int(self.width/8) * self.height)
-        buf = [0xFF] * (int(self.width / 4) * self.height)
         image_monocolor = image.convert('L')
         imwidth, imheight = image_monocolor.size
-        pixels = image_monocolor.load()
-        i=0
         # logger.debug("imwidth = %d, imheight = %d",imwidth,imheight)
         if(imwidth == self.width and imheight == self.height):
             logger.debug("Vertical")
-            for y in range(imheight):
-                for x in range(imwidth):
-                    # Set the bits for the column of pixels at the current position.
-                    if(pixels[x, y] == 0xC0):
-                        pixels[x, y] = 0x80
-                    elif (pixels[x, y] == 0x80):
-                        pixels[x, y] = 0x40
-                    i= i+1
-                    if(i%4 == 0):
-                        buf[int((x + (y * self.width))/4)] = ((pixels[x-3, y]&0xc0) | (pixels[x-2, y]&0xc0)>>2 | (pixels[x-1, y]&0xc0)>>4 | (pixels[x, y]&0xc0)>>6)
-                        
         elif(imwidth == self.height and imheight == self.width):
             logger.debug("Horizontal")
-            for x in range(imwidth):
-                for y in range(imheight):
-                    newx = y
-                    newy = self.height - x - 1
-                    if(pixels[x, y] == 0xC0):
-                        pixels[x, y] = 0x80
-                    elif (pixels[x, y] == 0x80):
-                        pixels[x, y] = 0x40
-                    i= i+1
-                    if(i%4 == 0):
-                        buf[int((newx + (newy * self.width))/4)] = ((pixels[x, y-3]&0xc0) | (pixels[x, y-2]&0xc0)>>2 | (pixels[x, y-1]&0xc0)>>4 | (pixels[x, y]&0xc0)>>6) 
-        return buf
+            image_monocolor = image_monocolor.rotate(90, expand=True)
+        else:
+            return bytearray([0xFF] * (int(self.width / 4) * self.height))
+        codes = image_monocolor.tobytes().translate(GRAY_CODE)
+        return bytearray(merge_bytes([codes[n::4].translate(GRAY_PACK[n]) for n in range(4)]))
     
     def display(self, image):
+        epdconfig.spi_counters(reset=True)
         self.send_command(0x10)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(0xFF)
+        self.send_data2(bytes([0xFF]) * int(self.width * self.height / 8))
         self.send_command(0x13)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(image[i])
+        self.send_data2(image[0:int(self.width * self.height / 8)])
         self.send_command(0x12) 
         self.ReadBusy()
+        self.frame_counters = epdconfig.spi_counters()
+        logger.debug("frame: %(bytes)d bytes in %(calls)d SPI calls", self.frame_counters)
+
+    # x and w are in panel pixels and must be multiples of 8,
+    # the controller ignores the low 3 bits of both
+    def window_header(self, x, y, w, l):
+        return bytes([x >> 8, x & 0xf8, y >> 8, y & 0xff, w >> 8, w & 0xf8, l >> 8, l & 0xff])
+
+    def getbuffer_window(self, buf, x, y, w, l):
+        # cut the (x, y, w, l) window out of a full frame from getbuffer
+        linewidth = int(self.width/8)
+        window = bytearray()
+        for row in range(y, y + l):
+            start = row * linewidth + int(x/8)
+            window += buf[start:start + int(w/8)]
+        return window
+
+    def display_window(self, window, x, y, w, l):
+        epdconfig.spi_counters(reset=True)
+        header = self.window_header(x, y, w, l)
+        self.send_command(0x14) # PARTIAL_DATA_START_TRANSMISSION_1
+        self.send_data2(header + bytes([0xFF]) * int(w * l / 8))
+        self.send_command(0x15) # PARTIAL_DATA_START_TRANSMISSION_2
+        self.send_data2(header + bytes(window[0:int(w * l / 8)]))
+        self.send_command(0x16) # PARTIAL_DISPLAY_REFRESH
+        self.send_data2(header)
+        self.ReadBusy()
+        self.frame_counters = epdconfig.spi_counters()
+        logger.debug("window: %(bytes)d bytes in %(calls)d SPI calls", self.frame_counters)
 
     def display_4Gray(self, image):
+        image = bytes(image[0:int(self.width * self.height / 4)])
+        even = image[0::2]
+        odd = image[1::2]
         self.send_command(0x10)
-        for i in range(0, 5808):                     #5808*4  46464
-            temp3=0
-            for j in range(0, 2):
-                temp1 = image[i*2+j]
-                for k in range(0, 2):
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):
-                        temp3 |= 0x01#white
-                    elif(temp2 == 0x00):
-                        temp3 |= 0x00  #black
-                    elif(temp2 == 0x80): 
-                        temp3 |= 0x01  #gray1
-                    else: #0x40
-                        temp3 |= 0x00 #gray2
-                    temp3 <<= 1	
-                    
-                    temp1 <<= 2
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):  #white
-                        temp3 |= 0x01
-                    elif(temp2 == 0x00): #black
-                        temp3 |= 0x00
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x01 #gray1
-                    else :   #0x40
-                            temp3 |= 0x00	#gray2	
-                    if(j!=1 or k!=1):				
-                        temp3 <<= 1
-                    temp1 <<= 2
-            self.send_data(temp3)
-            
-        self.send_command(0x13)	       
-        for i in range(0, 5808):                #5808*4  46464
-            temp3=0
-            for j in range(0, 2):
-                temp1 = image[i*2+j]
-                for k in range(0, 2):
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):
-                        temp3 |= 0x01#white
-                    elif(temp2 == 0x00):
-                        temp3 |= 0x00  #black
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x00  #gray1
-                    else: #0x40
-                        temp3 |= 0x01 #gray2
-                    temp3 <<= 1	
-                    
-                    temp1 <<= 2
-                    temp2 = temp1&0xC0 
-                    if(temp2 == 0xC0):  #white
-                        temp3 |= 0x01
-                    elif(temp2 == 0x00): #black
-                        temp3 |= 0x00
-                    elif(temp2 == 0x80):
-                        temp3 |= 0x00 #gray1
-                    else:    #0x40
-                            temp3 |= 0x01	#gray2
-                    if(j!=1 or k!=1):					
-                        temp3 <<= 1
-                    temp1 <<= 2
-            self.send_data(temp3)
+        self.send_data2(merge_bytes([even.translate(GRAY_PLANE1[0]), odd.translate(GRAY_PLANE1[1])]))
+        self.send_command(0x13)
+        self.send_data2(merge_bytes([even.translate(GRAY_PLANE2[0]), odd.translate(GRAY_PLANE2[1])]))
         
         self.gray_SetLut()
         self.send_command(0x12)
@@ -505,21 +411,18 @@ class EPD:
         # pass
         
     def Clear(self, color=0xFF):
+        epdconfig.spi_counters(reset=True)
         self.send_command(0x10)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(color)
+        self.send_data2(bytes([color]) * int(self.width * self.height / 8))
         self.send_command(0x13)
-        for i in range(0, int(self.width * self.height / 8)):
-            self.send_data(color)
+        self.send_data2(bytes([color]) * int(self.width * self.height / 8))
         self.send_command(0x12) 
         self.ReadBusy()
+        self.frame_counters = epdconfig.spi_counters()
+        logger.debug("frame: %(bytes)d bytes in %(calls)d SPI calls", self.frame_counters)
 
     def sleep(self):
-        self.send_command(0X50)
-        self.send_data(0xf7)
-        self.send_command(0X02)
-        self.send_command(0X07)
-        self.send_data(0xA5)
+        self.send_sequence(self.sleep_sequence)
         
         epdconfig.delay_ms(2000)
         epdconfig.module_exit()
@@ -43,6 +43,14 @@ class RaspberryPi:
     BUSY_PIN = 24
     PWR_PIN  = 17
 
+    # spidev rejects transfers larger than its bufsiz module parameter
+    SPI_CHUNK = 4096
+
+    # how long BUSY may take to leave its level after a command, and how
+    # often a wait re-reads the pin, in seconds
+    BUSY_EDGE_TIMEOUT = 0.02
+    BUSY_POLL = 0.05
+
     def __init__(self):
         import spidev
         import gpiozero
@@ -53,6 +61,8 @@ class RaspberryPi:
         # self.GPIO_CS_PIN     = gpiozero.LED(self.CS_PIN)
         self.GPIO_PWR_PIN    = gpiozero.LED(self.PWR_PIN)
         self.GPIO_BUSY_PIN   = gpiozero.Button(self.BUSY_PIN, pull_up = False)
+        self._spi_calls = 0
+        self._spi_bytes = 0
 
     def digital_write(self, pin, value):
         if pin == self.RST_PIN:
@@ -88,14 +98,48 @@ class RaspberryPi:
         elif pin == self.PWR_PIN:
             return self.PWR_PIN.value
 
+    # block until the pin reaches value, False if timeout (seconds) expired first
+    def digital_wait(self, pin, value, timeout=None):
+        if pin == self.BUSY_PIN:
+            busy = self.GPIO_BUSY_PIN
+            wait = busy.wait_for_active if value else busy.wait_for_inactive
+            leave = busy.wait_for_inactive if value else busy.wait_for_active
+            deadline = None if timeout is None else time.monotonic() + timeout
+            # The panel only leaves the current level a moment after the
+            # command, and gpiozero's events follow the pin from its edge
+            # thread, so right after the command they can still hold the
+            # old state. Give the leaving edge a chance first, then trust
+            # only the pin itself.
+            leave(self.BUSY_EDGE_TIMEOUT)
+            while busy.value != value:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                if wait(self.BUSY_POLL if remaining is None else min(remaining, self.BUSY_POLL)):
+                    # event set but pin not there yet: a stale event
+                    time.sleep(0.001)
+            return True
+
     def delay_ms(self, delaytime):
         time.sleep(delaytime / 1000.0)
 
     def spi_writebyte(self, data):
         self.SPI.writebytes(data)
+        self._spi_calls += 1
+        self._spi_bytes += len(data)
 
     def spi_writebyte2(self, data):
-        self.SPI.writebytes2(data)
+        for start in range(0, len(data), self.SPI_CHUNK):
+            self.SPI.writebytes2(data[start:start + self.SPI_CHUNK])
+            self._spi_calls += 1
+        self._spi_bytes += len(data)
+
+    def spi_counters(self, reset=False):
+        counters = {"calls": self._spi_calls, "bytes": self._spi_bytes}
+        if reset:
+            self._spi_calls = 0
+            self._spi_bytes = 0
+        return counters
 
     def module_init(self):
         self.GPIO_PWR_PIN.on()
@@ -123,7 +167,166 @@ class RaspberryPi:
             self.GPIO_PWR_PIN.close()
             self.GPIO_BUSY_PIN.close()
 
-implementation = RaspberryPi()
+class Virtual:
+    """Off-device stand-in for the panel.
+
+    Decodes the command/data stream sent by epd2in7.EPD into the displayed
+    frame, simulates BUSY timing and counts SPI and pin traffic.
+    """
+    # Pin definition
+    RST_PIN  = 18
+    DC_PIN   = 25
+    CS_PIN   = 8
+    BUSY_PIN = 24
+    PWR_PIN  = 17
+
+    # Panel geometry in the controller's native orientation
+    WIDTH  = 176
+    HEIGHT = 264
+
+    # How long BUSY stays low after these commands, in ms
+    BUSY_MS = {
+        0x04: 100,  # POWER_ON
+        0x12: 3000, # DISPLAY_REFRESH
+        0x16: 1500, # PARTIAL_DISPLAY_REFRESH
+    }
+
+    def __init__(self):
+        # EPD_VIRTUAL_PNG: where to write the frame after every refresh
+        # EPD_VIRTUAL_SPEED: divides all simulated delays, 0 disables them
+        self._png_path = os.environ.get("EPD_VIRTUAL_PNG")
+        self._speed = float(os.environ.get("EPD_VIRTUAL_SPEED", "1"))
+        self._pins = {self.RST_PIN: 0, self.DC_PIN: 0, self.CS_PIN: 1, self.PWR_PIN: 0}
+        self._busy_until = 0
+        self._command = None
+        self._payload = bytearray()
+        self._planes = {}
+        self._frame = bytearray([0xFF] * (self.WIDTH // 8 * self.HEIGHT))
+        self._refreshes = 0
+        self._spi_calls = 0
+        self._spi_bytes = 0
+        self._pin_writes = 0
+
+    def _delay(self, seconds):
+        if self._speed:
+            time.sleep(seconds / self._speed)
+
+    def _busy_for(self, ms):
+        if self._speed:
+            self._busy_until = time.monotonic() + ms / 1000.0 / self._speed
+
+    def _window(self, header):
+        x = (header[0] << 8 | header[1]) & 0xfff8
+        y = header[2] << 8 | header[3]
+        w = (header[4] << 8 | header[5]) & 0xfff8
+        l = header[6] << 8 | header[7]
+        return x, y, w, l
+
+    def _end_command(self):
+        # apply the command whose payload is complete
+        command, payload = self._command, bytes(self._payload)
+        if command in (0x10, 0x13, 0x14, 0x15):
+            self._planes[command] = payload
+        elif command == 0x12:
+            plane = self._planes.get(0x13, b'')
+            self._frame[0:len(plane)] = plane
+            self._refreshed()
+        elif command == 0x16 and len(payload) == 8 and 0x15 in self._planes:
+            x, y, w, l = self._window(payload)
+            window = self._planes[0x15][8:]
+            linewidth = self.WIDTH // 8
+            for row in range(l):
+                start = (y + row) * linewidth + x // 8
+                self._frame[start:start + w // 8] = window[row * w // 8:(row + 1) * w // 8]
+            self._refreshed()
+        elif command == 0x07:
+            logger.debug("virtual e-Paper in deep sleep")
+
+    def _refreshed(self):
+        self._refreshes += 1
+        if self._png_path:
+            self.frame_image().save(self._png_path)
+
+    def frame_image(self):
+        from PIL import Image
+        return Image.frombytes('1', (self.WIDTH, self.HEIGHT), bytes(self._frame))
+
+    def digital_write(self, pin, value):
+        self._pin_writes += 1
+        self._pins[pin] = value
+
+    def digital_read(self, pin):
+        if pin == self.BUSY_PIN:
+            return 0 if time.monotonic() < self._busy_until else 1
+        return self._pins.get(pin)
+
+    def digital_wait(self, pin, value, timeout=None):
+        if pin == self.BUSY_PIN:
+            remaining = self._busy_until - time.monotonic() if value else 0
+            if timeout is not None and remaining > timeout:
+                time.sleep(timeout)
+                return False
+            if remaining > 0:
+                time.sleep(remaining)
+            return True
+
+    def delay_ms(self, delaytime):
+        self._delay(delaytime / 1000.0)
+
+    def spi_writebyte(self, data):
+        self._spi_calls += 1
+        self._spi_bytes += len(data)
+        self._receive(data)
+
+    def spi_writebyte2(self, data):
+        self._spi_calls += (len(data) + RaspberryPi.SPI_CHUNK - 1) // RaspberryPi.SPI_CHUNK
+        self._spi_bytes += len(data)
+        self._receive(data)
+
+    def _receive(self, data):
+        if self._pins[self.DC_PIN]:
+            self._payload += bytes(data)
+            # the window refresh starts as soon as its header is in
+            if self._command == 0x16 and len(self._payload) == 8:
+                self._busy_for(self.BUSY_MS[0x16])
+                self._end_command()
+                self._command = None
+            return
+        for command in data:
+            if self._command is not None:
+                self._end_command()
+            self._command = command
+            self._payload = bytearray()
+            if command in (0x04, 0x12):
+                self._busy_for(self.BUSY_MS[command])
+            if command == 0x12:
+                self._end_command()
+                self._command = None
+
+    def spi_counters(self, reset=False):
+        counters = {"calls": self._spi_calls, "bytes": self._spi_bytes, "pin_writes": self._pin_writes}
+        if reset:
+            self._spi_calls = 0
+            self._spi_bytes = 0
+            self._pin_writes = 0
+        return counters
+
+    def module_init(self):
+        self._pins[self.PWR_PIN] = 1
+        return 0
+
+    def module_exit(self, cleanup=False):
+        logger.debug("spi end")
+        if self._command is not None:
+            self._end_command()
+            self._command = None
+        self._pins[self.PWR_PIN] = 0
+
+# EPD_BACKEND=virtual runs the driver without the panel attached
+if os.environ.get("EPD_BACKEND") == "virtual":
+    implementation = Virtual()
+else:
+    implementation = RaspberryPi()
 for func in [x for x in dir(implementation) if not x.startswith('_')]:
     setattr(sys.modules[__name__], func, getattr(implementation, func))
 
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Frame updates of the e-paper panel.
+
+A new frame refreshes only the window of bytes that changed since the
+previous one, with a full refresh after full_refresh_interval partial
+ones or when the window covers most of the panel. The panel is woken
+on demand and put into deep sleep after idle_timeout seconds unused.
+"""
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def dirty_ranges(old_frame, new_frame):
+    # [start, end) byte offsets at which the two frames differ
+    ranges = []
+    start = None
+    for offset, (old_byte, new_byte) in enumerate(zip(old_frame, new_frame)):
+        if old_byte != new_byte:
+            if start is None:
+                start = offset
+        elif start is not None:
+            ranges.append((start, offset))
+            start = None
+    if start is not None:
+        ranges.append((start, len(new_frame)))
+    return ranges
+
+
+class Panel:
+    """Pushes frames to an epd2in7.EPD; thread-safe."""
+
+    def __init__(self, epd, full_refresh_interval=10, idle_timeout=60):
+        self.epd = epd
+        self.full_refresh_interval = full_refresh_interval
+        self.idle_timeout = idle_timeout
+        self.last_frame = None
+        self.partial_refresh_count = 0
+        # serialises the button, HTTP and timer threads that use the panel
+        self.lock = threading.RLock()
+        self.awake = False
+        self.last_used = 0
+        self.sleep_timer = None
+
+    def changed_window(self, ranges):
+        # (x, y, w, l) in panel pixels covering ranges, x and w byte aligned
+        line_width = self.epd.width // 8
+        first_row = ranges[0][0] // line_width
+        last_row = (ranges[-1][1] - 1) // line_width
+        first_byte = line_width
+        last_byte = -1
+        for start, end in ranges:
+            if start // line_width == (end - 1) // line_width:
+                first_byte = min(first_byte, start % line_width)
+                last_byte = max(last_byte, (end - 1) % line_width)
+            else:
+                first_byte = 0
+                last_byte = line_width - 1
+        return (
+            first_byte * 8,
+            first_row,
+            (last_byte - first_byte + 1) * 8,
+            last_row - first_row + 1,
+        )
+
+    def refresh_window(self, frame):
+        # window to refresh partially for frame, None for a full refresh
+        if self.last_frame is None:
+            return None
+        ranges = dirty_ranges(self.last_frame, frame)
+        logger.debug(
+            "%d dirty bytes in %d ranges: %s",
+            sum(end - start for start, end in ranges),
+            len(ranges),
+            ranges,
+        )
+        if self.partial_refresh_count >= self.full_refresh_interval:
+            return None
+        window = self.changed_window(ranges)
+        # a window covering most of the panel gains nothing over a full refresh
+        if window[2] * window[3] > self.epd.width * self.epd.height // 2:
+            return None
+        return window
+
+    def wake(self):
+        self.last_used = time.monotonic()
+        if not self.awake:
+            self.epd.init()
+            self.awake = True
+
+    def sleep(self):
+        with self.lock:
+            if not self.awake:
+                return
+            # an update may have come in after this timer was started
+            if time.monotonic() - self.last_used < self.idle_timeout:
+                return
+            self.epd.sleep()
+            self.awake = False
+
+    def schedule_sleep(self):
+        if self.sleep_timer:
+            self.sleep_timer.cancel()
+        self.sleep_timer = threading.Timer(self.idle_timeout, self.sleep)
+        self.sleep_timer.daemon = True
+        self.sleep_timer.start()
+
+    def show(self, image):
+        frame = self.epd.getbuffer(image)
+        with self.lock:
+            if frame == self.last_frame:
+                logger.debug("frame unchanged, skipping refresh")
+                return
+            window = self.refresh_window(frame)
+            try:
+                self.wake()
+                if window:
+                    self.epd.display_window(
+                        self.epd.getbuffer_window(frame, *window), *window
+                    )
+                    self.partial_refresh_count += 1
+                else:
+                    self.epd.display(frame)
+                    self.partial_refresh_count = 0
+                self.last_frame = frame
+            except TimeoutError:
+                # the controller hung; the next frame resets it in init and
+                # is sent in full, as what the panel shows is unknown
+                self.awake = False
+                self.last_frame = None
+                raise
+            finally:
+                self.schedule_sleep()
+
+    def clear(self):
+        # blank the panel and leave it asleep, for shutdown
+        with self.lock:
+            if self.sleep_timer:
+                self.sleep_timer.cancel()
+            self.wake()
+            self.epd.Clear()
+            self.epd.sleep()
+            self.awake = False
+            self.last_frame = None
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Views drawn on the e-paper panel.
+
+A view is the label strip of the four buttons and a column of captions,
+each followed by its value, in a landscape image for EPD.getbuffer.
+"""
+import functools
+import logging
+import os
+
+from PIL import Image, ImageDraw, ImageFont
+
+import epd2in7
+
+logger = logging.getLogger(__name__)
+# EPD_FONT: TrueType font of the views
+FONT_PATH = os.environ.get("EPD_FONT", "/usr/share/fonts/truetype/DejaVuSansMono.ttf")
+
+
+def load_font(path):
+    try:
+        return ImageFont.truetype(path)
+    except OSError:
+        logger.warning("cannot open font %s, using Pillow's default", path)
+        return ImageFont.load_default()
+
+
+font = load_font(FONT_PATH)
+
+
+@functools.lru_cache(maxsize=16)
+def label_strip(label1, label2, label3, label4):
+    # 264 × 176
+    button_labels = Image.new("1", (176, font.size + 10), 255)
+    button_labels_draw = ImageDraw.Draw(button_labels)
+    button_labels_draw.text((22, 5), label1, font=font, anchor="ma")
+    button_labels_draw.text((66, 5), label2, font=font, anchor="ma")
+    button_labels_draw.text((110, 5), label3, font=font, anchor="ma")
+    button_labels_draw.text((154, 5), label4, font=font, anchor="ma")
+    button_labels_draw.rectangle([0, 0, 44, font.size + 10])
+    button_labels_draw.rectangle([44, 0, 88, font.size + 10])
+    button_labels_draw.rectangle([88, 0, 132, font.size + 10])
+    button_labels_draw.rectangle([132, 0, 176, font.size + 10])
+    return button_labels.rotate(-90, expand=1)
+
+
+def draw_labels(image, label1, label2, label3, label4):
+    image.paste(label_strip(label1, label2, label3, label4), (0, 0))
+
+
+@functools.lru_cache(maxsize=16)
+def view_template(labels, captions):
+    image = Image.new("1", (epd2in7.EPD_HEIGHT, epd2in7.EPD_WIDTH), 255)
+    draw_labels(image, *labels)
+    ImageDraw.Draw(image).text((font.size + 20, 10), captions, font=font)
+    return image
+
+
+def draw_view(labels, header, fields):
+    # captions and values sit on alternating lines; blank lines keep each
+    # value on the line it would take in the full text
+    caption_lines = header.split("\n")
+    value_lines = [""] * len(caption_lines)
+    for caption, value in fields:
+        caption_lines += [caption, ""]
+        value_lines += ["", f"{value}"]
+    image = view_template(labels, "\n".join(caption_lines)).copy()
+    ImageDraw.Draw(image).text((font.size + 20, 10), "\n".join(value_lines), font=font)
+    return image
+
+
+def dhcp_view(info, response_time=None):
+    # labels, header and fields of the DHCP view for get_dhcp_info's info;
+    # response_time is shown once the server's latency was measured
+    if info["dhcp_server_active"]:
+        labels = ("Refresh", "PTP", "Client", "Scan")
+    else:
+        if not info["foreign_dhcp_server"]:
+            labels = ("Refresh", "PTP", "Server", "Scan")
+        else:
+            labels = ("Refresh", "PTP", "Measure", "Scan")
+    if info["dhcp_server_active"]:
+        if info["leases"]:
+            leases = "\n".join(info["leases"])
+        else:
+            leases = "None"
+        return (
+            labels,
+            "Working as DHCP server",
+            (("My IP:", info["my_ip"]), ("Leases:", leases)),
+        )
+    fields = (
+        ("DHCP server IP:", info["foreign_dhcp_server"]),
+        ("Leased IP:", info["my_ip"] if info["carrier"] else "No link"),
+    )
+    if response_time:
+        fields += (("Response time (median/p99):", response_time),)
+    return labels, "Working as DHCP client", fields
+
+
+def ptp_view(info, master_active, discipline_active):
+    # labels, header and fields of the PTP view for get_ptp_status's info,
+    # None while ptp4l starts up or restarts
+    if master_active:
+        labels = ("Refresh", "DHCP", "Slave", "")
+    else:
+        labels = ("Refresh", "DHCP", "Master", "Sync")
+    if discipline_active:
+        labels = ("Refresh", "DHCP", "Master", "Free")
+    if info is None:
+        mode = "master" if master_active else "slave"
+        return labels, f"Working as PTP {mode}\n(ptp4l not responding)", ()
+    if master_active:
+        return (
+            labels,
+            "Working as PTP master",
+            (
+                ("My MAC:", info["current_master"]),
+                ("Current time:", info["current_time"]),
+                ("Clock count:", info["clock_count"]),
+            ),
+        )
+    if info["foreign_master"] and discipline_active:
+        return (
+            labels,
+            "Disciplining clock "
+            + ("(locked)" if info["discipline_converged"] else "(converging)"),
+            (
+                ("Master MAC:", info["current_master"]),
+                ("Master description:", info["master_description"]),
+                ("Current time:", info["current_time"]),
+                ("Residual offset:", f"{info['residual_offset']}ns"),
+                ("Clock count:", info["clock_count"]),
+            ),
+        )
+    if info["foreign_master"]:
+        return (
+            labels,
+            "Working as PTP slave",
+            (
+                ("Master MAC:", info["current_master"]),
+                ("Master description:", info["master_description"]),
+                ("Current time:", info["current_time"]),
+                ("Current offset:", f"{info['current_offset']}ns"),
+                ("Clock count:", info["clock_count"]),
+            ),
+        )
+    return (
+        labels,
+        "Working as PTP slave\n(No foreign master found)",
+        (("Clock count:", info["clock_count"]),),
+    )
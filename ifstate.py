@@ -0,0 +1,257 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Live carrier and IPv4 address state of one interface over rtnetlink.
+
+The state is loaded with RTM_GETLINK/RTM_GETADDR dumps and then kept
+current from the link and IPv4 address multicast groups, so reading it
+costs neither a process nor a syscall.
+"""
+import ipaddress
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# message types
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+
+# multicast groups as bind() bitmask
+RTMGRP_LINK = 0x01
+RTMGRP_IPV4_IFADDR = 0x10
+
+IFF_UP = 0x01
+IFF_LOWER_UP = 0x10000
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+IFA_CACHEINFO = 6
+IFA_FLAGS = 8
+IFA_F_PERMANENT = 0x80
+RT_SCOPE_UNIVERSE = 0
+INFINITY_LIFE_TIME = 0xFFFFFFFF
+
+NLMSGHDR = struct.Struct("=IHHII")
+IFINFOMSG = struct.Struct("=BxHiII")
+IFADDRMSG = struct.Struct("=BBBBI")
+RTATTR = struct.Struct("=HH")
+# ifa_prefered, ifa_valid, cstamp, tstamp
+IFA_CACHEINFO_DATA = struct.Struct("=IIII")
+
+
+@dataclass(frozen=True)
+class Address:
+    address: str
+    prefix_length: int
+    dynamic: bool  # has a lifetime, e.g. a DHCP lease
+    global_scope: bool
+    # monotonic end of the valid lifetime, None for a permanent address
+    valid_until: float
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def attributes(data, offset):
+    # {type: payload} of the rtattrs starting at offset
+    result = {}
+    while offset + RTATTR.size <= len(data):
+        length, kind = RTATTR.unpack_from(data, offset)
+        if length < RTATTR.size:
+            break
+        result[kind & 0x3FFF] = data[offset + RTATTR.size : offset + length]
+        offset += align(length)
+    return result
+
+
+def messages(data):
+    # (type, payload) of every netlink message in a datagram
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, kind, _, _, _ = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        yield kind, data[offset + NLMSGHDR.size : offset + length]
+        offset += align(length)
+
+
+class InterfaceState:
+    """Carrier and IPv4 addresses of ifname, updated on a daemon thread.
+
+    on_change is called from that thread whenever either changes.
+    """
+
+    def __init__(self, ifname="eth0", on_change=None, retry_interval=5):
+        self.ifname = ifname
+        self.on_change = on_change
+        # seconds between reloads while they keep failing
+        self.retry_interval = retry_interval
+        self.index = None
+        self.carrier = None
+        self.addresses = {}
+        # set when the state has to be reloaded from fresh dumps
+        self.stale = True
+        self.sequence = 0
+        self.lock = threading.Lock()
+        self.sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE
+        )
+        # subscribe before dumping so no change can fall in between
+        self.sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR))
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        # load the state right away if possible, the thread retries if not
+        try:
+            self.reload()
+        except OSError as error:
+            logger.warning("rtnetlink: %s, loading %s later", error, self.ifname)
+        self.thread.start()
+        return self
+
+    def reload(self):
+        with self.lock:
+            self.addresses.clear()
+        self.dump(RTM_GETLINK, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+        self.dump(RTM_GETADDR, IFADDRMSG.pack(socket.AF_INET, 0, 0, 0, 0))
+        self.stale = False
+
+    def dump(self, kind, payload):
+        self.sequence += 1
+        self.sock.send(
+            NLMSGHDR.pack(
+                NLMSGHDR.size + len(payload),
+                kind,
+                NLM_F_REQUEST | NLM_F_DUMP,
+                self.sequence,
+                0,
+            )
+            + payload
+        )
+        while not self.receive():
+            pass
+
+    def run(self):
+        while True:
+            if self.stale:
+                try:
+                    self.reload()
+                except OSError as error:
+                    logger.warning(
+                        "rtnetlink: %s, reloading %s in %d s",
+                        error,
+                        self.ifname,
+                        self.retry_interval,
+                    )
+                    time.sleep(self.retry_interval)
+                    continue
+            try:
+                self.receive()
+            except OSError as error:
+                # ENOBUFS: notifications were dropped, reload everything
+                logger.warning("rtnetlink: %s, reloading %s", error, self.ifname)
+                self.stale = True
+
+    def receive(self):
+        # handle one datagram; True once it ends a dump
+        done = False
+        changed = False
+        for kind, payload in messages(self.sock.recv(65536)):
+            if kind == NLMSG_DONE:
+                done = True
+            elif kind == NLMSG_ERROR:
+                error = -struct.unpack_from("=i", payload)[0]
+                if error:
+                    raise OSError(error, os.strerror(error))
+            elif kind in (RTM_NEWLINK, RTM_DELLINK):
+                changed |= self.update_link(kind, payload)
+            elif kind in (RTM_NEWADDR, RTM_DELADDR):
+                changed |= self.update_address(kind, payload)
+        if changed and self.on_change:
+            try:
+                self.on_change()
+            except Exception:
+                logger.exception("handling an interface change failed")
+        return done
+
+    def update_link(self, kind, payload):
+        _, _, index, flags, _ = IFINFOMSG.unpack_from(payload)
+        name = attributes(payload, IFINFOMSG.size).get(IFLA_IFNAME, b"")
+        if name.rstrip(b"\x00").decode() != self.ifname:
+            return False
+        carrier = kind == RTM_NEWLINK and bool(flags & IFF_UP and flags & IFF_LOWER_UP)
+        with self.lock:
+            changed = (self.index, self.carrier) != (index, carrier)
+            self.index = index
+            self.carrier = carrier
+        return changed
+
+    def update_address(self, kind, payload):
+        family, prefix_length, flags, scope, index = IFADDRMSG.unpack_from(payload)
+        if family != socket.AF_INET or index != self.index:
+            return False
+        attrs = attributes(payload, IFADDRMSG.size)
+        # IFA_LOCAL is the address itself, IFA_ADDRESS the peer on p2p links
+        raw = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+        if raw is None:
+            return False
+        address = socket.inet_ntoa(raw)
+        if IFA_FLAGS in attrs:
+            flags = struct.unpack("=I", attrs[IFA_FLAGS])[0]
+        valid_until = None
+        if IFA_CACHEINFO in attrs:
+            valid = IFA_CACHEINFO_DATA.unpack(attrs[IFA_CACHEINFO])[1]
+            if valid != INFINITY_LIFE_TIME:
+                valid_until = time.monotonic() + valid
+        with self.lock:
+            if kind == RTM_DELADDR:
+                return self.addresses.pop(address, None) is not None
+            old = self.addresses.get(address)
+            self.addresses[address] = Address(
+                address,
+                prefix_length,
+                not flags & IFA_F_PERMANENT,
+                scope == RT_SCOPE_UNIVERSE,
+                valid_until,
+            )
+            # lifetime updates alone (lease renewals) are not a change
+            return old is None or old.prefix_length != prefix_length
+
+    def address(self):
+        """Global IPv4 address of the interface, a DHCP lease first."""
+        with self.lock:
+            candidates = [a for a in self.addresses.values() if a.global_scope]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda a: a.dynamic).address
+
+    def lease(self):
+        """(address/prefix, seconds left) of the DHCP-acquired address."""
+        with self.lock:
+            leases = [
+                a
+                for a in self.addresses.values()
+                if a.dynamic and a.global_scope and a.valid_until is not None
+            ]
+        if not leases:
+            return None
+        lease = leases[0]
+        return (
+            str(ipaddress.ip_interface("%s/%d" % (lease.address, lease.prefix_length))),
+            max(0, round(lease.valid_until - time.monotonic())),
+        )
@@ -1,36 +1,130 @@
 #!/usr/bin/python
 # -*- coding:utf-8 -*-
 import subprocess
+import collections
 import dbus
-import re
+import dbus.mainloop.glib
+import dhcpprobe
+import dhcpservers
+import functools
+import ifstate
+import logging
+import math
 import shutil
+import socket
+import threading
+import time
 import epd2in7
+import epdpanel
+import epdview
 import flask
 import flask_cors
-import scapy.all as scapy
-from datetime import datetime, timezone
+import ptp4llog
+import ptpclocks
+import ptphistory
+import ptpmgmt
+from datetime import datetime, timedelta, timezone
 from signal import signal, SIGTERM, SIGINT
-from PIL import Image, ImageDraw, ImageFont
 from gpiozero import Button
+from gi.repository import GLib
 
-font = ImageFont.truetype("/usr/share/fonts/truetype/DejaVuSansMono.ttf")
+logger = logging.getLogger(__name__)
+epoch = datetime.fromtimestamp(0, tz=timezone.utc)
+# signals are dispatched by a GLib main loop on its own thread
+dbus.mainloop.glib.threads_init()
+dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 system_bus = dbus.SystemBus()
+# networkd's object for eth0, resolved by watch_dhcp_leases and retried
+# every eth0_link_retry seconds until networkd knows the link
+eth0_link = None
+eth0_link_lock = threading.Lock()
+eth0_link_retry = 10
+# "address MAC" strings of our DHCP server's leases, replaced on each
+# PropertiesChanged signal of the link
+dhcp_leases = []
+# carrier and addresses of eth0, kept current from rtnetlink notifications
+eth0_state = None
 epd = epd2in7.EPD()
+# partial refreshes between full ones, sleeps after a minute unused
+panel = epdpanel.Panel(epd, full_refresh_interval=10, idle_timeout=60)
 refresh_button = Button(5)
 view_button = Button(6)
 mode_button = Button(13)
 aux_button = Button(19)
 ptp_daemon = None
+ptp_client = ptpmgmt.ManagementClient()
+# CLOCK_DESCRIPTION is forwarded this many hops to reach every clock
+ptp_boundary_hops = 255
+# (info, TimeStatus, monotonic sample time) published by ptp_sampler and
+# ptp_subscriber, and the part of it shown on the e-paper
+ptp_snapshot = (None, None, 0)
+ptp_snapshot_lock = threading.Lock()
+ptp_shown_state = None
+ptp_sample_interval = 1
+# notifications keep the snapshot fresh while ptp4l synchronizes, so ptp4l
+# is only polled once the snapshot is this many seconds old
+ptp_sample_max_age = 2
+ptp_sample_requested = threading.Event()
+# CLOCK_REALTIME right before (old time base) and after (new time base) the
+# last step and the step in ns; ptp4l keeps reporting the offset measured
+# before a step until the next Sync arrives, and sync_time must not apply it
+# twice
+clock_step = None
+clock_step_lock = threading.Lock()
+# ptp4l pushes its TIME_STATUS_NP, PORT_DATA_SET and PARENT_DATA_SET updates
+# to this client; the subscription is renewed halfway through its duration
+# and again whenever ptp4l restarts
+ptp_events_client = ptpmgmt.ManagementClient(name="pmc-py-events")
+ptp_subscription_duration = 60
+ptp_subscription_lost = threading.Event()
+ptp_subscribed = False
+# clocks on the network, refreshed by broadcast queries every ptp_clocks_interval
+# seconds and dropped when unseen for ptp_clocks_max_age seconds
+ptp_clocks = ptpclocks.ClockInventory()
+ptp_clocks_interval = 10
+ptp_clocks_max_age = 60
+ptp_clocks_updated = -ptp_clocks_interval
+# one day of servo samples; ptp4l reports one per Sync, once a second by default
+ptp_history = ptphistory.History(capacity=86400, interval=1)
+# latest servo sample and port state change parsed from ptp4l's output
+ptp_servo = None
+ptp_port_state = None
+ptp_port_events = collections.deque(maxlen=32)
+ptp_port_changed = threading.Condition()
+ptp_uds_ready = False
+# give up on becoming master after this many seconds
+ptp_master_timeout = 30
+ptp_master_metrics = {"time_to_master": None, "failures": 0}
 ptp_master_active = False
+# in discipline mode ptp4l's PI servo slews the system clock toward the master;
+# the clock counts as converged once the servo is locked and the last
+# ptp_discipline_window offsets are all within ptp_discipline_threshold ns
+ptp_discipline_active = False
+ptp_discipline_threshold = 1000
+ptp_discipline_window = 16
+ptp_discipline_offsets = collections.deque(maxlen=ptp_discipline_window)
+ptp_discipline_metrics = {"started": None, "time_to_converge": None}
 dhcp_server_active = False
 foreign_dhcp_server = None
+# every DHCP server heard on eth0, fed by dhcp_monitor; foreign_dhcp_server
+# is the one heard from last
+dhcp_servers = dhcpservers.ServerTable()
+eth0_mac = dhcpprobe.interface_mac("eth0")
+dhcp_probe = dhcpprobe.Probe("eth0")
+# OFFERs are collected for dhcp_scan_window seconds; without any the
+# DISCOVER is repeated dhcp_scan_retries times with a doubled window
+dhcp_scan_window = 1
+dhcp_scan_retries = 1
+# result of the last dhcp_measure, shown on the DHCP view
+dhcp_latency = None
+dhcp_measure_count = 10
+# a measurement holds dhcp_probe for count * dhcp_scan_window seconds
+dhcp_measure_max_count = 60
+dhcp_measure_running = threading.Lock()
 current_view = "ptp"
-
-
-def show_image(image):
-    epd.init()
-    epd.display(epd.getbuffer(image))
-    epd.sleep()
+display_condition = threading.Condition()
+display_pending = False
+display_metrics = {"queued": 0, "coalesced": 0, "rendered": 0}
 
 
 def restart():
@@ -38,37 +132,152 @@ def restart():
 
 
 def end_program(signum, frame):
-    epd.init()
-    epd.Clear()
-    epd.sleep()
+    panel.clear()
     epd2in7.epdconfig.module_exit(cleanup=True)
     exit()
 
 
-def start_ptp_slave():
-    global ptp_daemon
-    if ptp_daemon:
-        ptp_daemon.terminate()
-    ptp_daemon = subprocess.Popen(
-        ["ptp4l", "-f", "/home/pi/program/ptpconfig", "-S", "-i", "eth0", "-s"]
+def on_servo_sample(daemon, sample):
+    global ptp_servo
+    if daemon is not ptp_daemon:
+        return
+    ptp_servo = sample
+    if not ptp_master_active:
+        ptp_history.push(
+            sample.time, sample.offset, sample.path_delay, sample.frequency
+        )
+    if ptp_discipline_active:
+        was_converged = discipline_converged()
+        ptp_discipline_offsets.append(sample.offset if sample.state == 2 else None)
+        converged = discipline_converged()
+        if converged != was_converged:
+            if converged and ptp_discipline_metrics["time_to_converge"] is None:
+                ptp_discipline_metrics["time_to_converge"] = round(
+                    time.monotonic() - ptp_discipline_metrics["started"], 3
+                )
+            logger.info("system clock %s", "locked" if converged else "lost lock")
+            if current_view == "ptp":
+                refresh()
+
+
+def discipline_converged():
+    # offsets of samples taken before the servo locked are stored as None
+    offsets = list(ptp_discipline_offsets)
+    return len(offsets) == ptp_discipline_window and all(
+        offset is not None and abs(offset) <= ptp_discipline_threshold
+        for offset in offsets
     )
 
 
-def start_ptp_master():
-    global ptp_daemon
+def residual_offset():
+    # RMS of the recent locked offsets in ns
+    offsets = [offset for offset in list(ptp_discipline_offsets) if offset is not None]
+    if not offsets:
+        return None
+    return round(math.sqrt(sum(offset * offset for offset in offsets) / len(offsets)))
+
+
+def on_port_event(daemon, event):
+    global ptp_port_state, ptp_uds_ready
+    if daemon is not ptp_daemon:
+        return
+    with ptp_port_changed:
+        # port 0 is the management socket, it comes up before the network port
+        if event.port == 0:
+            ptp_uds_ready = event.new_state == "LISTENING"
+            if ptp_uds_ready:
+                ptp_subscription_lost.set()
+        else:
+            ptp_port_state = event
+            ptp_port_events.append(event)
+        ptp_port_changed.notify_all()
+
+
+def on_ptp4l_exit(daemon):
+    # end of output means ptp4l is exiting, reap it so poll() reports it
+    daemon.wait()
+    with ptp_port_changed:
+        ptp_port_changed.notify_all()
+
+
+def spawn_ptp4l(args):
+    global ptp_daemon, ptp_servo, ptp_port_state, ptp_uds_ready
     if ptp_daemon:
         ptp_daemon.terminate()
-    ptp_daemon = subprocess.Popen(
-        ["ptp4l", "-f", "/home/pi/program/ptpconfig", "-S", "-i", "eth0"]
-    )
-    while True:
-        result = subprocess.run(
-            ["pmc", "-u", "-b", "0", "SET PRIORITY1 0"], capture_output=True, text=True
+        try:
+            ptp_daemon.wait(5)
+        except subprocess.TimeoutExpired:
+            logger.warning("ptp4l did not exit within 5 s, killing it")
+            ptp_daemon.kill()
+            ptp_daemon.wait()
+    with ptp_port_changed:
+        ptp_servo = None
+        ptp_port_state = None
+        ptp_uds_ready = False
+        # -m prints the servo and port state messages parsed by ptp4llog
+        daemon = subprocess.Popen(
+            ["ptp4l", "-f", "/home/pi/program/ptpconfig", "-S", "-i", "eth0", "-m"]
+            + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        ptp_daemon = daemon
+    ptp4llog.LogReader(
+        daemon.stdout,
+        functools.partial(on_servo_sample, daemon),
+        functools.partial(on_port_event, daemon),
+        functools.partial(on_ptp4l_exit, daemon),
+    ).start()
+    return daemon
+
+
+def start_ptp_slave():
+    if ptp_discipline_active:
+        # overrides free_running from ptpconfig, so the servo adjusts the clock
+        spawn_ptp4l(["-s", "--free_running=0"])
+    else:
+        spawn_ptp4l(["-s"])
+
+
+def wait_for_ptp4l(daemon, predicate, deadline):
+    # True once predicate holds, False if ptp4l exits or the deadline passes
+    with ptp_port_changed:
+        ptp_port_changed.wait_for(
+            lambda: predicate() or daemon.poll() is not None,
+            timeout=max(0, deadline - time.monotonic()),
         )
-        if result.returncode == 0:
-            for line in result.stdout.split("\n"):
-                if "priority1" in line and line.split()[-1] == "0":
-                    return
+        return daemon.poll() is None and bool(predicate())
+
+
+def start_ptp_master():
+    started = time.monotonic()
+    deadline = started + ptp_master_timeout
+    daemon = spawn_ptp4l([])
+    if not wait_for_ptp4l(daemon, lambda: ptp_uds_ready, deadline):
+        return master_takeover_failed("management socket did not come up")
+    delay = 0.05
+    while ptp_client.set_priority1(0) != 0:
+        if daemon.poll() is not None or time.monotonic() + delay > deadline:
+            return master_takeover_failed("PRIORITY1 was not accepted")
+        time.sleep(delay)
+        delay = min(delay * 2, 2)
+    if not wait_for_ptp4l(
+        daemon,
+        lambda: ptp_port_state
+        and ptp_port_state.new_state in ("MASTER", "GRAND_MASTER"),
+        deadline,
+    ):
+        return master_takeover_failed("port did not enter MASTER state")
+    ptp_master_metrics["time_to_master"] = round(time.monotonic() - started, 3)
+    logger.info("PTP master after %.3f s", ptp_master_metrics["time_to_master"])
+    return True
+
+
+def master_takeover_failed(reason):
+    ptp_master_metrics["failures"] += 1
+    logger.error("PTP master takeover failed: %s", reason)
+    return False
 
 
 def start_eth_dhcp():
@@ -81,30 +290,189 @@ def start_eth_static():
     subprocess.run(["networkctl", "reload"], capture_output=True, text=True)
 
 
-def dhcp_scan():
+def on_dhcp_reply(reply):
+    if reply.server_mac == eth0_mac:
+        return
+    if dhcp_servers.update(
+        reply.server_ip,
+        reply.server_mac,
+        reply.message_type,
+        reply.offered_ip,
+        reply.subnet_mask,
+        time.time(),
+        reply.xid,
+    ):
+        logger.warning("DHCP server %s (%s) on eth0", reply.server_ip, reply.server_mac)
+    update_foreign_dhcp_server()
+
+
+def update_foreign_dhcp_server(redraw=False):
     global foreign_dhcp_server
-    scapy.conf.checkIPaddr = False
-    fam, hw = scapy.get_if_raw_hwaddr("eth0")
-    dhcp_discover = (
-        scapy.Ether(dst="ff:ff:ff:ff:ff:ff")
-        / scapy.IP(src="0.0.0.0", dst="255.255.255.255")
-        / scapy.UDP(sport=68, dport=67)
-        / scapy.BOOTP(chaddr=hw)
-        / scapy.DHCP(options=[("message-type", "discover"), "end"])
-    )
-    ans, unans = scapy.srp(
-        dhcp_discover, multi=True, timeout=1, verbose=0, iface="eth0"
+    server = dhcp_servers.latest()
+    changed = server != foreign_dhcp_server
+    foreign_dhcp_server = server
+    if server and dhcp_server_active:
+        # a second server on the segment, step back to being a client
+        toggle_dhcp_server()
+    elif (changed or redraw) and current_view == "dhcp":
+        refresh()
+
+
+def dhcp_scan():
+    started = time.time()
+    # the monitor may not have handled the OFFERs yet, they are recorded
+    # here as well and counted once; servers that did not answer this scan
+    # are gone
+    for reply in dhcp_probe.discover(
+        window=dhcp_scan_window, retries=dhcp_scan_retries, backoff=2
+    ):
+        on_dhcp_reply(reply)
+    dhcp_servers.expire(started)
+    update_foreign_dhcp_server(redraw=True)
+
+
+def dhcp_measure(count=None, request=False):
+    global dhcp_latency
+    servers = dhcp_probe.measure(
+        count or dhcp_measure_count, request, window=dhcp_scan_window
     )
-    for snd, rcv in ans:
-        if scapy.DHCP in rcv and rcv[scapy.DHCP].options[0][1] == 2:
-            dhcp_server_ip = rcv[scapy.IP].src
-            foreign_dhcp_server = dhcp_server_ip
-            if dhcp_server_active:
-                toggle_dhcp_server()
-            elif current_view == "dhcp":
-                refresh()
-            return
-    foreign_dhcp_server = None
+    dhcp_latency = {
+        "time": time.time(),
+        "count": count or dhcp_measure_count,
+        "request": request,
+        "servers": [server for server in servers if server["server_mac"] != eth0_mac],
+    }
+    if current_view == "dhcp":
+        refresh()
+    return dhcp_latency
+
+
+def start_dhcp_measure():
+    # button callback; the measurement runs on its own thread so the other
+    # buttons stay responsive, and further presses are ignored until it ends
+    if not dhcp_measure_running.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            dhcp_measure()
+        except Exception:
+            logger.exception("DHCP measurement failed")
+        finally:
+            dhcp_measure_running.release()
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def dhcp_response_time(server_ip):
+    # "median/p99 ms, loss" of server_ip's OFFERs from the last measurement
+    if not dhcp_latency:
+        return None
+    for server in dhcp_latency["servers"]:
+        if server["server_ip"] == server_ip:
+            offer = server["offer"]
+            if not offer["samples"]:
+                return "no answer"
+            return (
+                f"{offer['median']:.1f}/{offer['p99']:.1f} ms, "
+                f"loss {offer['loss']:.0%}"
+            )
+    return "no answer"
+
+
+def format_leases(lease_struct):
+    # (family, client id, address, gateway, hardware address, expiration)
+    return [
+        "%s %s"
+        % (
+            ".".join(str(int(byte)) for byte in lease[2]),
+            ":".join("%02x" % int(byte) for byte in lease[4][:6]),
+        )
+        for lease in lease_struct
+    ]
+
+
+def load_dhcp_leases():
+    global dhcp_leases
+    if eth0_link is None:
+        return
+    try:
+        dhcp_leases = format_leases(
+            eth0_link.Get(
+                "org.freedesktop.network1.DHCPServer",
+                "Leases",
+                dbus_interface="org.freedesktop.DBus.Properties",
+            )
+        )
+    except dbus.exceptions.DBusException:
+        # no DHCP server on the link (yet)
+        dhcp_leases = []
+
+
+def on_link_properties_changed(interface, changed, invalidated):
+    global dhcp_leases
+    if interface != "org.freedesktop.network1.DHCPServer":
+        return
+    if "Leases" in changed:
+        dhcp_leases = format_leases(changed["Leases"])
+    elif "Leases" in invalidated:
+        load_dhcp_leases()
+    else:
+        return
+    if dhcp_server_active and current_view == "dhcp":
+        refresh()
+
+
+def resolve_eth0_link():
+    # True once subscribed to the PropertiesChanged signals of eth0's link
+    global eth0_link
+    with eth0_link_lock:
+        if eth0_link is not None:
+            return True
+        try:
+            name, path = system_bus.get_object(
+                "org.freedesktop.network1", "/org/freedesktop/network1"
+            ).GetLinkByIndex(
+                socket.if_nametoindex("eth0"),
+                dbus_interface="org.freedesktop.network1.Manager",
+            )
+        except (dbus.exceptions.DBusException, OSError) as error:
+            logger.debug("eth0 is not managed by systemd-networkd: %s", error)
+            return False
+        system_bus.add_signal_receiver(
+            on_link_properties_changed,
+            signal_name="PropertiesChanged",
+            dbus_interface="org.freedesktop.DBus.Properties",
+            bus_name="org.freedesktop.network1",
+            path=path,
+        )
+        eth0_link = system_bus.get_object("org.freedesktop.network1", path)
+    load_dhcp_leases()
+    return True
+
+
+def retry_eth0_link():
+    # GLib timeout callback, repeated for as long as it returns True
+    if not resolve_eth0_link():
+        return True
+    logger.info("watching the DHCP leases of eth0")
+    if dhcp_server_active and current_view == "dhcp":
+        refresh()
+    return False
+
+
+def watch_dhcp_leases():
+    if not resolve_eth0_link():
+        logger.error(
+            "eth0 is not managed by systemd-networkd, retrying every %d s",
+            eth0_link_retry,
+        )
+        GLib.timeout_add_seconds(eth0_link_retry, retry_eth0_link)
+    # signal handlers and the retry run on the GLib main loop
+    threading.Thread(target=GLib.MainLoop().run, daemon=True).start()
+
+
+def on_eth0_change():
     if current_view == "dhcp":
         refresh()
 
@@ -115,43 +483,20 @@ def get_dhcp_info():
         "my_ip": None,
         "leases": None,
         "foreign_dhcp_server": foreign_dhcp_server,
+        "carrier": eth0_state.carrier,
+        "lease": None,
+        "lease_time_left": None,
     }
     if dhcp_server_active:
         info.update({"my_ip": "10.0.0.1"})
-        try:
-            link = subprocess.run(
-                ["ip --oneline link show dev eth0 | cut -f 1 -d:"],
-                capture_output=True,
-                shell=True,
-                text=True,
-            ).stdout.strip()
-            lease_struct = system_bus.get_object(
-                "org.freedesktop.network1", "/org/freedesktop/network1/link/" + link
-            ).Get(
-                "org.freedesktop.network1.DHCPServer",
-                "Leases",
-                dbus_interface="org.freedesktop.DBus.Properties",
-            )
-            leases = list(
-                map(
-                    lambda l: ".".join(map(str, map(int, l[2])))
-                    + " "
-                    + ":".join(map(lambda n: "%x" % n, l[4][:6])),
-                    lease_struct,
-                )
-            )
-            if leases:
-                info.update({"leases": leases})
-        except dbus.exceptions.DBusException:
-            return info
+        leases = dhcp_leases
+        if leases:
+            info.update({"leases": list(leases)})
     else:
-        result = subprocess.run(
-            ["networkctl", "status"], capture_output=True, text=True
-        )
-        for line in result.stdout.split("\n"):
-            if re.match(r".*\d+\.\d+\.\d+\.\d+ on eth0", line):
-                info.update({"my_ip": line.split()[-3]})
-                break
+        info.update({"my_ip": eth0_state.address()})
+        lease = eth0_state.lease()
+        if lease:
+            info.update({"lease": lease[0], "lease_time_left": lease[1]})
     return info
 
 
@@ -161,7 +506,7 @@ def clock_identity_to_mac(clock_identity):
     return ":".join(a + b for a, b in zip(parts[::2], parts[1::2]))
 
 
-def get_ptp_info():
+def get_ptp_info(status):
     info = {
         "ptp_master_active": ptp_master_active,
         "foreign_master": False,
@@ -171,27 +516,18 @@ def get_ptp_info():
         "master_description": None,
         "clock_count": None,
     }
-    result = subprocess.run(
-        ["pmc", "-u", "-b", "0", "GET TIME_STATUS_NP"], capture_output=True, text=True
-    )
-    if result.returncode == 0:
-        time = 0
-        for line in result.stdout.split("\n"):
-            if not ptp_master_active:
-                if "gmPresent" in line and "true" in line:
-                    info.update({"foreign_master": True})
-                if "ingress_time" in line:
-                    time += int(line.split()[-1])
-                if "master_offset" in line:
-                    time -= int(line.split()[-1])
-                    info.update({"current_offset": line.split()[-1]})
-            if "gmIdentity" in line:
-                info.update({"current_master": clock_identity_to_mac(line.split()[-1])})
+    if status:
+        if not ptp_master_active:
+            if status.gm_present:
+                info.update({"foreign_master": True})
+            info.update({"current_offset": str(status.master_offset)})
+        info.update({"current_master": clock_identity_to_mac(status.gm_identity)})
         if not ptp_master_active:
             info.update(
                 {
                     "current_time": datetime.fromtimestamp(
-                        time / 1e9, tz=timezone.utc
+                        (status.ingress_time - status.master_offset) / 1e9,
+                        tz=timezone.utc,
                     ).strftime("%Y-%m-%d %H:%M:%S.%f")
                 }
             )
@@ -205,106 +541,174 @@ def get_ptp_info():
             )
     else:
         return None
-    result = subprocess.run(
-        ["pmc", "-u", "-b", "1000", "GET CLOCK_DESCRIPTION"],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode == 0:
-        master_found = False
-        client_count = -1
-        for line in result.stdout.split("\n"):
-            if re.match(r"^\t[a-f\d]{6}\.[a-f\d]{4}\.[a-f\d]{6}", line):
-                client_count += 1
-            if (
-                not info["master_description"]
-                and info["foreign_master"]
-                and info["current_master"]
-            ):
-                if (
-                    not master_found
-                    and "physicalAddress" in line
-                    and info["current_master"] in line
-                ):
-                    master_found = True
-                if master_found and "productDescription" in line:
-                    master_description = line.strip().split(maxsplit=1)[-1].split(";")
-                    if master_description[0] or master_description[1]:
-                        info.update(
-                            {
-                                "master_description": master_description[0]
-                                + ":"
-                                + master_description[1]
-                            }
-                        )
-        info.update({"clock_count": client_count})
-    else:
-        return None
+    if info["foreign_master"] and info["current_master"]:
+        master = ptp_clocks.find_mac(info["current_master"])
+        if master and (master["manufacturer"] or master["model"]):
+            info.update(
+                {"master_description": master["manufacturer"] + ":" + master["model"]}
+            )
+    # the local ptp4l answers the inventory queries too
+    info.update({"clock_count": ptp_clocks.count(exclude=status.source.clock_identity)})
     return info
 
 
-def draw_labels(image, label1, label2, label3, label4):
-    # 264 × 176
-    button_labels = Image.new("1", (176, font.size + 10), 255)
-    button_labels_draw = ImageDraw.Draw(button_labels)
-    button_labels_draw.text((22, 5), label1, font=font, anchor="ma")
-    button_labels_draw.text((66, 5), label2, font=font, anchor="ma")
-    button_labels_draw.text((110, 5), label3, font=font, anchor="ma")
-    button_labels_draw.text((154, 5), label4, font=font, anchor="ma")
-    button_labels_draw.rectangle([0, 0, 44, font.size + 10])
-    button_labels_draw.rectangle([44, 0, 88, font.size + 10])
-    button_labels_draw.rectangle([88, 0, 132, font.size + 10])
-    button_labels_draw.rectangle([132, 0, 176, font.size + 10])
-    button_labels = button_labels.rotate(-90, expand=1)
-    image.paste(button_labels, (0, 0))
+def update_ptp_clocks():
+    now = time.time()
+    for description in (
+        ptp_client.clock_descriptions(boundary_hops=ptp_boundary_hops) or []
+    ):
+        ptp_clocks.update_description(description, now)
+    for port_data_set in (
+        ptp_client.port_data_sets(boundary_hops=ptp_boundary_hops) or []
+    ):
+        ptp_clocks.update_port(port_data_set, now)
+    ptp_clocks.expire(now - ptp_clocks_max_age)
+
+
+def shown_ptp_state(info):
+    # everything show_ptp draws except the values that change with every sync
+    if info is None:
+        return None
+    port = ptp_port_state
+    return (
+        tuple(
+            value
+            for key, value in info.items()
+            if key not in ("current_time", "current_offset")
+        ),
+        port.new_state if port else None,
+    )
+
+
+def publish_ptp_status(status, sampled_at):
+    global ptp_snapshot, ptp_shown_state
+    info = get_ptp_info(status)
+    with ptp_snapshot_lock:
+        if sampled_at < ptp_snapshot[2]:
+            return
+        ptp_snapshot = (info, status, sampled_at)
+        state = shown_ptp_state(info)
+        changed = state != ptp_shown_state
+        ptp_shown_state = state
+    if changed and current_view == "ptp":
+        refresh()
+
+
+def sample_ptp():
+    sampled_at = time.monotonic()
+    publish_ptp_status(ptp_client.time_status(), sampled_at)
+
+
+def ptp_sampler():
+    global ptp_clocks_updated
+    while True:
+        redraw = ptp_sample_requested.is_set()
+        ptp_sample_requested.clear()
+        try:
+            if redraw or time.monotonic() - ptp_snapshot[2] >= ptp_sample_max_age:
+                sample_ptp()
+            now = time.monotonic()
+            if ptp_snapshot[1] and now - ptp_clocks_updated >= ptp_clocks_interval:
+                update_ptp_clocks()
+                ptp_clocks_updated = now
+        except Exception:
+            logger.exception("sampling PTP status failed")
+        if redraw and current_view == "ptp":
+            refresh()
+        ptp_sample_requested.wait(ptp_sample_interval)
+
+
+def on_ptp_notification(notification):
+    if isinstance(notification, ptpmgmt.TimeStatus):
+        # the same data a TIME_STATUS_NP poll returns
+        publish_ptp_status(notification, time.monotonic())
+        return
+    if isinstance(notification, ptpmgmt.PortDataSet):
+        ptp_clocks.update_port(notification, time.time())
+    # port state or grandmaster changed, TIME_STATUS_NP has the new master
+    sample_ptp()
+
+
+def ptp_subscriber():
+    global ptp_subscribed
+    renew_at = 0
+    while True:
+        if ptp_subscription_lost.is_set() or time.monotonic() >= renew_at:
+            ptp_subscription_lost.clear()
+            ptp_subscribed = ptp_events_client.subscribe(
+                (
+                    ptpmgmt.NOTIFY_PORT_STATE,
+                    ptpmgmt.NOTIFY_TIME_SYNC,
+                    ptpmgmt.NOTIFY_PARENT_DATA_SET,
+                ),
+                ptp_subscription_duration,
+            )
+            if ptp_subscribed:
+                renew_at = time.monotonic() + ptp_subscription_duration / 2
+            else:
+                # ptp4l is not up yet, or too old to support subscriptions
+                renew_at = time.monotonic() + ptp_sample_max_age
+        # wake up every second to notice a restarted ptp4l
+        notification = ptp_events_client.notification(
+            max(0, min(1, renew_at - time.monotonic()))
+        )
+        if notification is None:
+            continue
+        try:
+            on_ptp_notification(notification)
+        except Exception:
+            logger.exception("handling a ptp4l notification failed")
+
+
+def get_ptp_status():
+    info, status, sampled_at = ptp_snapshot
+    if info is None:
+        return None
+    servo = ptp_servo
+    port = ptp_port_state
+    return dict(
+        info,
+        sample_age=round(time.monotonic() - sampled_at, 3),
+        servo_state=servo.state if servo else None,
+        path_delay=servo.path_delay if servo else None,
+        frequency=servo.frequency if servo else None,
+        port_state=port.new_state if port else None,
+        time_to_master=ptp_master_metrics["time_to_master"],
+        master_failures=ptp_master_metrics["failures"],
+        events_subscribed=ptp_subscribed,
+        discipline_active=ptp_discipline_active,
+        discipline_converged=discipline_converged() if ptp_discipline_active else None,
+        residual_offset=residual_offset() if ptp_discipline_active else None,
+        time_to_converge=ptp_discipline_metrics["time_to_converge"],
+        port_events=[
+            {
+                "time": event.time,
+                "port": event.port,
+                "from": event.old_state,
+                "to": event.new_state,
+                "event": event.event,
+            }
+            for event in list(ptp_port_events)
+        ],
+    )
 
 
 def show_dhcp():
     info = get_dhcp_info()
-    image = Image.new("1", (epd.height, epd.width), 255)
-    if dhcp_server_active:
-        draw_labels(image, "Refresh", "PTP", "Client", "Scan")
-    else:
-        if not foreign_dhcp_server:
-            draw_labels(image, "Refresh", "PTP", "Server", "Scan")
-        else:
-            draw_labels(image, "Refresh", "PTP", "", "Scan")
-    draw = ImageDraw.Draw(image)
-    if dhcp_server_active:
-        if info["leases"]:
-            leases = "\n".join(info["leases"])
-        else:
-            leases = "None"
-        response = f"Working as DHCP server\nMy IP:\n{info['my_ip']}\nLeases:\n{leases}"
-    else:
-        response = f"Working as DHCP client\nDHCP server IP:\n{info['foreign_dhcp_server']}\nLeased IP:\n{info['my_ip']}"
-    draw.text((font.size + 20, 10), response, font=font)
-    show_image(image)
+    response_time = dhcp_response_time(info["foreign_dhcp_server"])
+    panel.show(epdview.draw_view(*epdview.dhcp_view(info, response_time)))
 
 
 def show_ptp():
-    image = Image.new("1", (epd.height, epd.width), 255)
-    if ptp_master_active:
-        draw_labels(image, "Refresh", "DHCP", "Slave", "")
-    else:
-        draw_labels(image, "Refresh", "DHCP", "Master", "Sync")
-    draw = ImageDraw.Draw(image)
-    info = get_ptp_info()
-    if ptp_master_active:
-        response = f"Working as PTP master\nMy MAC:\n{info['current_master']}\nCurrent time:\n{info['current_time']}\nClock count:\n{info['clock_count']}"
-    else:
-        if info["foreign_master"]:
-            response = f"Working as PTP slave\nMaster MAC:\n{info['current_master']}\nMaster description:\n{info['master_description']}\nCurrent time:\n{info['current_time']}\nCurrent offset:\n{info['current_offset']}ns\nClock count:\n{info['clock_count']}"
-        else:
-            response = f"Working as PTP slave\n(No foreign master found)\nClock count:\n{info['clock_count']}"
-    draw.text((font.size + 20, 10), response, font=font)
-    show_image(image)
+    info = get_ptp_status()
+    view = epdview.ptp_view(info, ptp_master_active, ptp_discipline_active)
+    panel.show(epdview.draw_view(*view))
 
 
-def refresh():
+def render():
     if current_view == "dhcp":
         if foreign_dhcp_server:
-            mode_button.when_pressed = None
+            mode_button.when_pressed = start_dhcp_measure
         else:
             mode_button.when_pressed = toggle_dhcp_server
         aux_button.when_pressed = dhcp_scan
@@ -313,11 +717,39 @@ def refresh():
         mode_button.when_pressed = toggle_ptp_master
         if ptp_master_active:
             aux_button.when_pressed = None
+        elif ptp_discipline_active:
+            aux_button.when_pressed = toggle_ptp_discipline
         else:
             aux_button.when_pressed = sync_time
         show_ptp()
 
 
+def refresh():
+    global display_pending
+    with display_condition:
+        display_metrics["queued"] += 1
+        if display_pending:
+            display_metrics["coalesced"] += 1
+        display_pending = True
+        display_condition.notify()
+
+
+def display_worker():
+    global display_pending
+    while True:
+        with display_condition:
+            while not display_pending:
+                display_condition.wait()
+            display_pending = False
+        try:
+            render()
+        except Exception:
+            logger.exception("rendering the e-paper view failed")
+            continue
+        with display_condition:
+            display_metrics["rendered"] += 1
+
+
 def switch_view():
     global current_view
     if current_view == "dhcp":
@@ -328,15 +760,34 @@ def switch_view():
 
 
 def toggle_ptp_master():
-    global ptp_master_active
+    global ptp_master_active, ptp_discipline_active
     if ptp_master_active:
         start_ptp_slave()
         ptp_master_active = False
     else:
-        start_ptp_master()
-        ptp_master_active = True
-    if current_view == "ptp":
-        refresh()
+        ptp_discipline_active = False
+        if start_ptp_master():
+            ptp_master_active = True
+        else:
+            start_ptp_slave()
+    ptp_sample_requested.set()
+
+
+def toggle_ptp_discipline():
+    global ptp_discipline_active
+    if ptp_master_active:
+        return
+    ptp_discipline_active = not ptp_discipline_active
+    start_ptp_slave()
+    # samples of the previous ptp4l are ignored from here on
+    ptp_discipline_offsets.clear()
+    ptp_discipline_metrics.update(
+        {
+            "started": time.monotonic() if ptp_discipline_active else None,
+            "time_to_converge": None,
+        }
+    )
+    ptp_sample_requested.set()
 
 
 def toggle_dhcp_server():
@@ -347,50 +798,100 @@ def toggle_dhcp_server():
     else:
         if not foreign_dhcp_server:
             start_eth_static()
+            # networkd may only know eth0 once it is configured
+            resolve_eth0_link()
+            # drop the leases of an earlier run, new ones arrive as signals
+            load_dhcp_leases()
             dhcp_server_active = True
     if current_view == "dhcp":
         refresh()
 
 
-def set_time(datetime):
-    subprocess.run(
-        [
-            "timedatectl",
-            "set-time",
-            datetime.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f"),
-        ],
-        capture_output=True,
-        text=True,
-    )
-    if current_view == "ptp":
-        refresh()
+def step_clock(target, reference):
+    """Step CLOCK_REALTIME to target, the wall time in ns at monotonic reference.
+
+    The time elapsed since reference is added right before the clock is
+    set. The result has the size of the step, the compensated delay and
+    the error measured against the monotonic clock afterwards, all in ns,
+    or is None if the clock could not be set.
+    """
+    global clock_step
+    before = time.clock_gettime_ns(time.CLOCK_REALTIME)
+    now = time.monotonic_ns()
+    try:
+        time.clock_settime_ns(time.CLOCK_REALTIME, target + now - reference)
+    except OSError as error:
+        logger.error("setting the system clock failed: %s", error)
+        return None
+    # midpoint of two monotonic reads brackets the realtime read
+    start = time.monotonic_ns()
+    after = time.clock_gettime_ns(time.CLOCK_REALTIME)
+    end = time.monotonic_ns()
+    clock_step = (before, after, target + now - reference - before)
+    return {
+        "step_ns": target + now - reference - before,
+        "compensated_ns": now - reference,
+        "error_ns": after - target - ((start + end) // 2 - reference),
+    }
+
+
+def measured_before_step(status):
+    # True if status comes from a Sync received before the last clock step
+    if not clock_step:
+        return False
+    before, after, step = clock_step
+    if status.ingress_time < after:
+        return True
+    if status.ingress_time > before:
+        return False
+    # after a backward step the ingress time fits both time bases; a Sync
+    # from before the step still has the offset the step took away
+    return abs(status.master_offset) > abs(status.master_offset + step)
+
+
+def set_time(datetime, reference=None):
+    if reference is None:
+        reference = time.monotonic_ns()
+    with clock_step_lock:
+        result = step_clock(
+            (datetime.astimezone(timezone.utc) - epoch)
+            // timedelta(microseconds=1)
+            * 1000,
+            reference,
+        )
+    ptp_sample_requested.set()
+    return result
 
 
 def sync_time():
-    if ptp_master_active:
-        return
-    result = subprocess.run(
-        ["pmc", "-u", "-b", "0", "GET TIME_STATUS_NP"], capture_output=True, text=True
-    )
-    if result.returncode == 0:
-        time = 0
-        foreign = False
-        for line in result.stdout.split("\n"):
-            if "gmPresent" in line and "true" in line:
-                foreign = True
-            if "ingress_time" in line:
-                time += int(line.split()[-1])
-            if "master_offset" in line:
-                time -= int(line.split()[-1])
-        if foreign:
-            set_time(datetime.fromtimestamp(time / 1e9, tz=timezone.utc))
-            if current_view == "ptp":
-                refresh()
+    if ptp_master_active or ptp_discipline_active:
+        return None
+    with clock_step_lock:
+        info, status, sampled_at = ptp_snapshot
+        if not status or not status.gm_present or measured_before_step(status):
+            return None
+        # master_offset is local minus master time; ptp4l timestamps with
+        # the system clock (-S), so the master time now is the local time
+        # now minus the offset, however old the sample is
+        reference = time.monotonic_ns()
+        result = step_clock(
+            time.clock_gettime_ns(time.CLOCK_REALTIME) - status.master_offset,
+            reference,
+        )
+    ptp_sample_requested.set()
+    return result
 
 
+threading.Thread(target=display_worker, daemon=True).start()
+dhcp_monitor = dhcpprobe.Monitor("eth0", on_dhcp_reply).start()
+watch_dhcp_leases()
+eth0_state = ifstate.InterfaceState("eth0", on_eth0_change).start()
 dhcp_scan()
 start_eth_dhcp()
 start_ptp_slave()
+sample_ptp()
+threading.Thread(target=ptp_sampler, daemon=True).start()
+threading.Thread(target=ptp_subscriber, daemon=True).start()
 refresh()
 refresh_button.when_pressed = refresh
 view_button.when_pressed = switch_view
@@ -406,7 +907,29 @@ flask_cors.CORS(app)
 
 @app.get("/ptp_info")
 def ptp_info_handler():
-    return flask.jsonify(get_ptp_info())
+    return flask.jsonify(get_ptp_status())
+
+
+@app.get("/ptp_clocks")
+def ptp_clocks_handler():
+    return flask.jsonify(ptp_clocks.snapshot())
+
+
+@app.get("/ptp_history")
+def ptp_history_handler():
+    return flask.jsonify(
+        ptp_history.snapshot(flask.request.args.get("buckets", 100, type=int))
+    )
+
+
+@app.get("/display_info")
+def display_info_handler():
+    with display_condition:
+        info = dict(display_metrics)
+    info.update(
+        {"busy_ms_histogram": epd.busy_histogram(), "last_busy_ms": epd.last_busy_ms}
+    )
+    return flask.jsonify(info)
 
 
 @app.get("/dhcp_info")
@@ -414,6 +937,40 @@ def dhcp_info_handler():
     return flask.jsonify(get_dhcp_info())
 
 
+@app.get("/dhcp_servers")
+def dhcp_servers_handler():
+    return flask.jsonify(dhcp_servers.snapshot())
+
+
+@app.get("/dhcp_latency")
+def dhcp_latency_handler():
+    return flask.jsonify(dhcp_latency)
+
+
+@app.post("/dhcp_measure")
+def dhcp_measure_handler():
+    options = flask.request.get_json(silent=True) or {}
+    if not isinstance(options, dict):
+        return flask.Response(status=400)
+    count = options.get("count", dhcp_measure_count)
+    if (
+        not isinstance(count, int)
+        or isinstance(count, bool)
+        or not 1 <= count <= dhcp_measure_max_count
+    ):
+        return flask.Response(status=400)
+    request = options.get("request", False)
+    if not isinstance(request, bool):
+        return flask.Response(status=400)
+    # one measurement at a time, also against the Measure button's
+    if not dhcp_measure_running.acquire(blocking=False):
+        return flask.Response(status=409)
+    try:
+        return flask.jsonify(dhcp_measure(count, request))
+    finally:
+        dhcp_measure_running.release()
+
+
 @app.post("/dhcp_toggle")
 def dhcp_toggle_handler():
     toggle_dhcp_server()
@@ -432,16 +989,25 @@ def ptp_toggle_handler():
     return flask.Response(status=200)
 
 
+@app.post("/ptp_discipline")
+def ptp_discipline_handler():
+    toggle_ptp_discipline()
+    return flask.Response(status=200)
+
+
 @app.post("/set_time")
 def set_time_handler():
-    set_time(datetime.fromisoformat(flask.request.json["time"]))
-    return flask.Response(status=200)
+    # the delay from here to the clock step is compensated
+    received = time.monotonic_ns()
+    result = set_time(datetime.fromisoformat(flask.request.json["time"]), received)
+    if result is None:
+        return flask.Response(status=500)
+    return flask.jsonify(result)
 
 
 @app.post("/sync_time")
 def sync_time_handler():
-    sync_time()
-    return flask.Response(status=200)
+    return flask.jsonify(sync_time())
 
 
 @app.errorhandler(404)
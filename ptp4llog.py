@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Streaming parser for the messages ptp4l prints with -m.
+
+Servo summaries and port state transitions are turned into dataclasses
+and handed to callbacks as soon as ptp4l prints them.
+"""
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+# ptp4l[1234.567]: master offset        -12 s2 freq   +1234 path delay       456
+SERVO_LINE = re.compile(
+    r"master offset\s+(-?\d+) s(\d) freq\s+([-+]?\d+) path delay\s+(-?\d+)"
+)
+# ptp4l[1234.567]: port 1 (eth0): LISTENING to UNCALIBRATED on RS_SLAVE
+# (older releases leave out the interface name)
+PORT_LINE = re.compile(r"port (\d+)(?: \(([^)]*)\))?: (\w+) to (\w+) on (\w+)")
+
+
+@dataclass(frozen=True)
+class ServoSample:
+    time: float
+    offset: int  # ns
+    state: int  # 0 unlocked, 1 clock step, 2 locked
+    frequency: int  # ppb
+    path_delay: int  # ns
+
+
+@dataclass(frozen=True)
+class PortEvent:
+    time: float
+    port: int
+    interface: str
+    old_state: str
+    new_state: str
+    event: str
+
+
+def parse_line(line, now=None):
+    """ServoSample or PortEvent for a line of ptp4l output, else None."""
+    if "master offset" in line:
+        match = SERVO_LINE.search(line)
+        if match:
+            offset, state, frequency, path_delay = match.groups()
+            return ServoSample(
+                now or time.time(),
+                int(offset),
+                int(state),
+                int(frequency),
+                int(path_delay),
+            )
+    elif " to " in line:
+        match = PORT_LINE.search(line)
+        if match:
+            port, interface, old_state, new_state, event = match.groups()
+            return PortEvent(
+                now or time.time(), int(port), interface, old_state, new_state, event
+            )
+    return None
+
+
+class LogReader:
+    """Reads ptp4l's stdout on a daemon thread until the pipe closes.
+
+    The pipe is drained even if a callback fails, so ptp4l never blocks
+    on a full stdout.
+    """
+
+    def __init__(self, stream, on_sample=None, on_port_event=None, on_close=None):
+        self.stream = stream
+        self.on_sample = on_sample
+        self.on_port_event = on_port_event
+        self.on_close = on_close
+        self.lines = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        for line in self.stream:
+            self.lines += 1
+            try:
+                message = parse_line(line)
+                if isinstance(message, ServoSample):
+                    if self.on_sample:
+                        self.on_sample(message)
+                elif isinstance(message, PortEvent):
+                    logger.info(
+                        "ptp4l port %d: %s -> %s (%s)",
+                        message.port,
+                        message.old_state,
+                        message.new_state,
+                        message.event,
+                    )
+                    if self.on_port_event:
+                        self.on_port_event(message)
+            except Exception:
+                logger.exception("handling ptp4l output failed: %r", line)
+        logger.debug("ptp4l output closed after %d lines", self.lines)
+        if self.on_close:
+            self.on_close()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Inventory of the PTP clocks seen on the network.
+
+Entries are keyed by clockIdentity and updated in place from each
+management reply, with a second index by MAC address for the
+grandmaster lookup. Clocks that stop answering are expired.
+"""
+import threading
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class Clock:
+    clock_identity: str
+    first_seen: float
+    last_seen: float
+    mac: str = None
+    manufacturer: str = None
+    model: str = None
+    product_description: str = None
+    port_states: dict = field(default_factory=dict)
+
+
+class ClockInventory:
+    def __init__(self):
+        self.clocks = {}
+        self.by_mac = {}
+        self.lock = threading.Lock()
+
+    def entry(self, clock_identity, now):
+        clock = self.clocks.get(clock_identity)
+        if clock is None:
+            clock = self.clocks[clock_identity] = Clock(clock_identity, now, now)
+        clock.last_seen = now
+        return clock
+
+    def update_description(self, description, now):
+        with self.lock:
+            clock = self.entry(description.source.clock_identity, now)
+            if clock.mac != description.physical_address:
+                self.by_mac.pop(clock.mac, None)
+                clock.mac = description.physical_address
+                self.by_mac[clock.mac] = clock
+            if clock.product_description != description.product_description:
+                # manufacturer;model;serial number
+                parts = description.product_description.split(";") + ["", ""]
+                clock.product_description = description.product_description
+                clock.manufacturer = parts[0]
+                clock.model = parts[1]
+
+    def update_port(self, port_data_set, now):
+        with self.lock:
+            port = port_data_set.port_identity
+            clock = self.entry(port.clock_identity, now)
+            clock.port_states[port.port_number] = port_data_set.port_state
+
+    def expire(self, before):
+        with self.lock:
+            for clock_identity, clock in list(self.clocks.items()):
+                if clock.last_seen < before:
+                    del self.clocks[clock_identity]
+                    if self.by_mac.get(clock.mac) is clock:
+                        del self.by_mac[clock.mac]
+
+    def find_mac(self, mac):
+        with self.lock:
+            clock = self.by_mac.get(mac)
+            return asdict(clock) if clock else None
+
+    def count(self, exclude=None):
+        with self.lock:
+            return len(self.clocks) - (exclude in self.clocks)
+
+    def snapshot(self):
+        with self.lock:
+            return [asdict(clock) for clock in self.clocks.values()]
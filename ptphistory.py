@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""Fixed-size history of PTP servo samples.
+
+Samples live in preallocated arrays used as a ring, so memory does not
+grow with uptime. Window sums for the summary statistics and the
+Allan/time deviations are updated as samples come in and drop out; they
+are kept as exact integers so evicting old outliers leaves no rounding
+residue behind.
+"""
+import math
+import threading
+from array import array
+
+# stored as printed by ptp4l: master offset and path delay in ns, servo
+# frequency adjustment in ppb
+FIELDS = ("offset", "path_delay", "frequency")
+# averaging factors (in samples) for ADEV/TDEV
+TAUS = (1, 10, 100, 1000, 10000)
+
+
+def wrap(value):
+    # int64 two's complement, differences of wrapped prefixes stay exact
+    return (value + 2**63) % 2**64 - 2**63
+
+
+class History:
+    """Ring buffer of (time, offset, path delay, frequency) samples.
+
+    ADEV/TDEV treat the offsets as phase samples taken every interval
+    seconds, so samples are expected to arrive at that rate.
+    """
+
+    def __init__(self, capacity=86400, interval=1, taus=TAUS):
+        self.capacity = capacity
+        self.interval = interval
+        self.taus = taus
+        self.times = array("d", bytes(8 * capacity))
+        self.values = {field: array("q", bytes(8 * capacity)) for field in FIELDS}
+        # prefix[i] = sum of the offsets before sample i, wrapped to int64
+        self.prefix = array("q", bytes(8 * capacity))
+        self.offset_total = 0
+        self.total = 0
+        self.count = 0
+        self.sums = dict.fromkeys(FIELDS, 0)
+        self.squares = dict.fromkeys(FIELDS, 0)
+        self.adev_sums = dict.fromkeys(taus, 0)
+        self.tdev_sums = dict.fromkeys(taus, 0)
+        self.lock = threading.Lock()
+
+    def offset(self, index):
+        return self.values["offset"][index % self.capacity]
+
+    def offset_sum(self, start, end):
+        # sum of the offsets of samples start..end-1
+        if end == self.total:
+            end_prefix = wrap(self.offset_total)
+        else:
+            end_prefix = self.prefix[end % self.capacity]
+        return wrap(end_prefix - self.prefix[start % self.capacity])
+
+    def second_difference(self, index, m):
+        return (
+            self.offset(index + 2 * m) - 2 * self.offset(index + m) + self.offset(index)
+        )
+
+    def tdev_term(self, index, m):
+        # sum of second_difference(index .. index + m - 1, m)
+        return (
+            self.offset_sum(index + 2 * m, index + 3 * m)
+            - 2 * self.offset_sum(index + m, index + 2 * m)
+            + self.offset_sum(index, index + m)
+        )
+
+    def evict(self):
+        oldest = self.total - self.count
+        for m in self.taus:
+            if self.count >= 2 * m + 1:
+                self.adev_sums[m] -= self.second_difference(oldest, m) ** 2
+            if self.count >= 3 * m:
+                self.tdev_sums[m] -= self.tdev_term(oldest, m) ** 2
+        slot = oldest % self.capacity
+        for field, values in self.values.items():
+            self.sums[field] -= values[slot]
+            self.squares[field] -= values[slot] ** 2
+        self.count -= 1
+
+    def push(self, timestamp, offset, path_delay, frequency):
+        """Add one sample; offset and path_delay in ns, frequency in ppb."""
+        with self.lock:
+            if self.count == self.capacity:
+                self.evict()
+            newest = self.total
+            slot = newest % self.capacity
+            self.times[slot] = timestamp
+            for field, value in (
+                ("offset", offset),
+                ("path_delay", path_delay),
+                ("frequency", frequency),
+            ):
+                self.values[field][slot] = value
+                self.sums[field] += value
+                self.squares[field] += value**2
+            self.prefix[slot] = wrap(self.offset_total)
+            self.offset_total += offset
+            self.total += 1
+            self.count += 1
+            for m in self.taus:
+                if self.count >= 2 * m + 1:
+                    self.adev_sums[m] += self.second_difference(newest - 2 * m, m) ** 2
+                if self.count >= 3 * m:
+                    self.tdev_sums[m] += self.tdev_term(newest - 3 * m + 1, m) ** 2
+
+    def clear(self):
+        with self.lock:
+            self.__init__(self.capacity, self.interval, self.taus)
+
+    def ordered(self, values):
+        start = (self.total - self.count) % self.capacity
+        if self.count < self.capacity:
+            return values[: self.count]
+        return values[start:] + values[:start]
+
+    def statistics(self):
+        n = self.count
+        statistics = {}
+        for field in FIELDS:
+            if not n:
+                statistics[field] = None
+                continue
+            total, squares = self.sums[field], self.squares[field]
+            statistics[field] = {
+                "mean": total / n,
+                "rms": math.sqrt(squares / n),
+                "stddev": math.sqrt((n * squares - total * total) / (n * (n - 1)))
+                if n > 1
+                else 0.0,
+            }
+        adev = {}
+        tdev = {}
+        for m in self.taus:
+            tau = m * self.interval
+            if n >= 2 * m + 1:
+                adev[tau] = math.sqrt(self.adev_sums[m] / (2 * (n - 2 * m))) / tau / 1e9
+            if n >= 3 * m:
+                tdev[tau] = math.sqrt(self.tdev_sums[m] / (6 * m * m * (n - 3 * m + 1)))
+        return statistics, adev, tdev
+
+    def snapshot(self, buckets=100):
+        """Summary plus min/max/mean per bucket for the whole window."""
+        with self.lock:
+            statistics, adev, tdev = self.statistics()
+            times = self.ordered(self.times)
+            values = {field: self.ordered(self.values[field]) for field in FIELDS}
+        n = len(times)
+        buckets = max(1, min(buckets, n))
+        series = {"time": []}
+        for field in FIELDS:
+            series[field] = {"min": [], "max": [], "mean": []}
+        for bucket in range(buckets if n else 0):
+            start = bucket * n // buckets
+            end = (bucket + 1) * n // buckets
+            series["time"].append(times[start])
+            for field in FIELDS:
+                chunk = values[field][start:end]
+                series[field]["min"].append(min(chunk))
+                series[field]["max"].append(max(chunk))
+                series[field]["mean"].append(sum(chunk) / len(chunk))
+        return {
+            "interval": self.interval,
+            "sample_count": n,
+            "statistics": statistics,
+            "adev": adev,
+            "tdev": tdev,
+            "series": series,
+        }
@@ -0,0 +1,470 @@
+#!/usr/bin/python
+# -*- coding:utf-8 -*-
+"""In-process replacement for `pmc -u`.
+
+Speaks IEEE 1588 management messages to ptp4l over its UNIX domain socket
+and returns the replies as dataclasses.
+"""
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+PTP4L_SOCKET = "/var/run/ptp4l"
+
+# managementId values
+CLOCK_DESCRIPTION = 0x0001
+PARENT_DATA_SET = 0x2002
+PORT_DATA_SET = 0x2004
+PRIORITY1 = 0x2005
+TIME_STATUS_NP = 0xC000
+SUBSCRIBE_EVENTS_NP = 0xC003
+
+# SUBSCRIBE_EVENTS_NP bits; ptp4l pushes PORT_DATA_SET, TIME_STATUS_NP and
+# PARENT_DATA_SET responses respectively to the subscribed socket
+NOTIFY_PORT_STATE = 0
+NOTIFY_TIME_SYNC = 1
+NOTIFY_PARENT_DATA_SET = 2
+EVENT_BITMASK_SIZE = 64
+
+# actionField values
+GET = 0
+SET = 1
+RESPONSE = 2
+COMMAND = 3
+ACKNOWLEDGE = 4
+
+TLV_MANAGEMENT = 0x0001
+TLV_MANAGEMENT_ERROR_STATUS = 0x0002
+
+# transportSpecific/messageType, versionPTP, messageLength, domainNumber,
+# reserved, flagField, correctionField, reserved, sourcePortIdentity,
+# sequenceId, controlField, logMessageInterval
+HEADER = struct.Struct(">BBHBBHq4s8sHHBb")
+# targetPortIdentity, startingBoundaryHops, boundaryHops, actionField, reserved
+MANAGEMENT = struct.Struct(">8sHBBBB")
+TLV = struct.Struct(">HHH")
+MESSAGE_MANAGEMENT = 0x0D
+CONTROL_MANAGEMENT = 0x04
+WILDCARD_PORT = (b"\xff" * 8, 0xFFFF)
+# int64 master_offset, int64 ingress_time, cumulativeScaledRateOffset,
+# scaledLastGmPhaseChange, gmTimeBaseIndicator, lastGmPhaseChange,
+# gmPresent, gmIdentity
+TIME_STATUS = struct.Struct(">qqiiH12si8s")
+# portIdentity, portState, logMinDelayReqInterval, peerMeanPathDelay,
+# logAnnounceInterval, announceReceiptTimeout, logSyncInterval,
+# delayMechanism, logMinPdelayReqInterval, versionNumber
+PORT_DATA = struct.Struct(">8sHBbqbBbBbB")
+# parentPortIdentity, parentStats, reserved,
+# observedParentOffsetScaledLogVariance, observedParentClockPhaseChangeRate,
+# grandmasterPriority1, grandmasterClockQuality, grandmasterPriority2,
+# grandmasterIdentity
+PARENT_DATA = struct.Struct(">8sHBBHiBBBHB8s")
+PORT_STATES = {
+    1: "INITIALIZING",
+    2: "FAULTY",
+    3: "DISABLED",
+    4: "LISTENING",
+    5: "PRE_MASTER",
+    6: "MASTER",
+    7: "PASSIVE",
+    8: "UNCALIBRATED",
+    9: "SLAVE",
+}
+
+
+def format_clock_identity(identity):
+    # same notation as pmc, e.g. b827eb.fffe.123456
+    return "%s.%s.%s" % (identity[:3].hex(), identity[3:5].hex(), identity[5:8].hex())
+
+
+@dataclass(frozen=True)
+class PortIdentity:
+    clock_identity: str
+    port_number: int
+
+
+@dataclass(frozen=True)
+class TimeStatus:
+    source: PortIdentity
+    master_offset: int
+    ingress_time: int
+    cumulative_scaled_rate_offset: int
+    scaled_last_gm_phase_change: int
+    gm_time_base_indicator: int
+    gm_present: bool
+    gm_identity: str
+
+
+@dataclass(frozen=True)
+class PortDataSet:
+    source: PortIdentity
+    port_identity: PortIdentity
+    port_state: str
+    peer_mean_path_delay: int  # 2^-16 ns
+    log_announce_interval: int
+    log_sync_interval: int
+
+
+@dataclass(frozen=True)
+class ParentDataSet:
+    source: PortIdentity
+    parent_port_identity: PortIdentity
+    grandmaster_priority1: int
+    grandmaster_clock_class: int
+    grandmaster_clock_accuracy: int
+    grandmaster_priority2: int
+    grandmaster_identity: str
+
+
+@dataclass(frozen=True)
+class ClockDescription:
+    source: PortIdentity
+    clock_type: int
+    physical_layer_protocol: str
+    physical_address: str
+    protocol_address: bytes
+    manufacturer_identity: str
+    product_description: str
+    revision_data: str
+    user_description: str
+
+
+class Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def take(self, length):
+        chunk = self.data[self.offset : self.offset + length]
+        if len(chunk) != length:
+            raise ValueError("truncated management TLV")
+        self.offset += length
+        return chunk
+
+    def u8(self):
+        return self.take(1)[0]
+
+    def u16(self):
+        return struct.unpack(">H", self.take(2))[0]
+
+    def text(self):
+        return self.take(self.u8()).decode("utf-8", "replace")
+
+
+def parse_time_status(source, data):
+    (
+        master_offset,
+        ingress_time,
+        rate_offset,
+        phase_change,
+        time_base,
+        _,
+        gm_present,
+        gm_identity,
+    ) = TIME_STATUS.unpack_from(data)
+    return TimeStatus(
+        source,
+        master_offset,
+        ingress_time,
+        rate_offset,
+        phase_change,
+        time_base,
+        bool(gm_present),
+        format_clock_identity(gm_identity),
+    )
+
+
+def parse_port_data_set(source, data):
+    (
+        clock_identity,
+        port_number,
+        port_state,
+        _,
+        peer_mean_path_delay,
+        log_announce_interval,
+        _,
+        log_sync_interval,
+        _,
+        _,
+        _,
+    ) = PORT_DATA.unpack_from(data)
+    return PortDataSet(
+        source,
+        PortIdentity(format_clock_identity(clock_identity), port_number),
+        PORT_STATES.get(port_state, str(port_state)),
+        peer_mean_path_delay,
+        log_announce_interval,
+        log_sync_interval,
+    )
+
+
+def parse_parent_data_set(source, data):
+    (
+        clock_identity,
+        port_number,
+        _,
+        _,
+        _,
+        _,
+        priority1,
+        clock_class,
+        clock_accuracy,
+        _,
+        priority2,
+        grandmaster_identity,
+    ) = PARENT_DATA.unpack_from(data)
+    return ParentDataSet(
+        source,
+        PortIdentity(format_clock_identity(clock_identity), port_number),
+        priority1,
+        clock_class,
+        clock_accuracy,
+        priority2,
+        format_clock_identity(grandmaster_identity),
+    )
+
+
+# parsers for the responses ptp4l sends to subscribers
+NOTIFICATIONS = {
+    PORT_DATA_SET: parse_port_data_set,
+    TIME_STATUS_NP: parse_time_status,
+    PARENT_DATA_SET: parse_parent_data_set,
+}
+
+
+def parse_clock_description(source, data):
+    reader = Reader(data)
+    clock_type = reader.u16()
+    physical_layer_protocol = reader.text()
+    physical_address = reader.take(reader.u16())
+    reader.u16()  # networkProtocol
+    protocol_address = reader.take(reader.u16())
+    manufacturer_identity = reader.take(3)
+    reader.take(1)
+    return ClockDescription(
+        source,
+        clock_type,
+        physical_layer_protocol,
+        ":".join("%02x" % b for b in physical_address),
+        protocol_address,
+        manufacturer_identity.hex(":"),
+        reader.text(),
+        reader.text(),
+        reader.text(),
+    )
+
+
+class ManagementClient:
+    """Persistent management connection to one ptp4l instance.
+
+    Thread-safe; every request holds the socket until its replies are in.
+    """
+
+    def __init__(self, server_path=PTP4L_SOCKET, domain=0, name="pmc-py"):
+        self.server_path = server_path
+        self.domain = domain
+        self.client_path = "/var/run/%s.%d" % (name, os.getpid())
+        self.port_identity = (b"\x00" * 8, os.getpid() & 0xFFFF)
+        self.sequence_id = 0
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.sock:
+            return
+        if os.path.exists(self.client_path):
+            os.unlink(self.client_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.client_path)
+        self.sock = sock
+
+    def close(self):
+        with self.lock:
+            if self.sock:
+                self.sock.close()
+                self.sock = None
+                os.unlink(self.client_path)
+
+    def build(self, action, management_id, data=b"", boundary_hops=0):
+        if len(data) % 2:
+            data += b"\x00"
+        tlv = TLV.pack(TLV_MANAGEMENT, 2 + len(data), management_id) + data
+        length = HEADER.size + MANAGEMENT.size + len(tlv)
+        header = HEADER.pack(
+            MESSAGE_MANAGEMENT,
+            0x02,
+            length,
+            self.domain,
+            0,
+            0,
+            0,
+            b"\x00" * 4,
+            self.port_identity[0],
+            self.port_identity[1],
+            self.sequence_id,
+            CONTROL_MANAGEMENT,
+            0x7F,
+        )
+        management = MANAGEMENT.pack(
+            *WILDCARD_PORT, boundary_hops, boundary_hops, action, 0
+        )
+        return header + management + tlv
+
+    def unpack(self, message):
+        # (sequenceId, managementId, source, data) of a response, None otherwise
+        if len(message) < HEADER.size + MANAGEMENT.size + TLV.size:
+            return None
+        header = HEADER.unpack_from(message)
+        if header[0] & 0x0F != MESSAGE_MANAGEMENT:
+            return None
+        action = MANAGEMENT.unpack_from(message, HEADER.size)[4] & 0x0F
+        if action not in (RESPONSE, ACKNOWLEDGE):
+            return None
+        tlv_type, tlv_length, tlv_id = TLV.unpack_from(
+            message, HEADER.size + MANAGEMENT.size
+        )
+        data_start = HEADER.size + MANAGEMENT.size + TLV.size
+        source = PortIdentity(format_clock_identity(header[8]), header[9])
+        if tlv_type == TLV_MANAGEMENT_ERROR_STATUS:
+            logger.warning(
+                "%s: management error 0x%04x for id 0x%04x",
+                source.clock_identity,
+                tlv_id,
+                struct.unpack_from(">H", message, data_start)[0],
+            )
+            return None
+        if tlv_type != TLV_MANAGEMENT:
+            return None
+        return (
+            header[10],
+            tlv_id,
+            source,
+            message[data_start : data_start + tlv_length - 2],
+        )
+
+    def parse(self, message, management_id):
+        # (source, data) of a reply to the pending request, None otherwise
+        reply = self.unpack(message)
+        if not reply or reply[:2] != (self.sequence_id, management_id):
+            return None
+        return reply[2:]
+
+    def request(
+        self, action, management_id, data=b"", boundary_hops=0, timeout=0.5, wait=0
+    ):
+        """Send one request and collect its replies.
+
+        Returns after the first reply unless wait is set, in which case
+        replies are gathered for wait seconds. An empty list means ptp4l
+        did not answer.
+        """
+        replies = []
+        with self.lock:
+            self.sequence_id = (self.sequence_id + 1) & 0xFFFF
+            message = self.build(action, management_id, data, boundary_hops)
+            try:
+                self.connect()
+                self.sock.sendto(message, self.server_path)
+                deadline = time.monotonic() + (wait or timeout)
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.sock.settimeout(remaining)
+                    try:
+                        reply = self.parse(self.sock.recv(1500), management_id)
+                    except socket.timeout:
+                        break
+                    if reply:
+                        replies.append(reply)
+                        if not wait:
+                            break
+            except OSError as error:
+                logger.debug("ptp4l management request failed: %s", error)
+        return replies
+
+    def time_status(self):
+        replies = self.request(GET, TIME_STATUS_NP)
+        if not replies:
+            return None
+        return parse_time_status(*replies[0])
+
+    def clock_descriptions(self, boundary_hops=255, wait=0.5):
+        descriptions = []
+        for source, data in self.request(
+            GET, CLOCK_DESCRIPTION, boundary_hops=boundary_hops, wait=wait
+        ):
+            try:
+                descriptions.append(parse_clock_description(source, data))
+            except ValueError:
+                logger.warning("malformed CLOCK_DESCRIPTION from %s", source)
+        if not descriptions:
+            return None
+        return descriptions
+
+    def port_data_sets(self, boundary_hops=255, wait=0.5):
+        port_data_sets = []
+        for source, data in self.request(
+            GET, PORT_DATA_SET, boundary_hops=boundary_hops, wait=wait
+        ):
+            try:
+                port_data_sets.append(parse_port_data_set(source, data))
+            except struct.error:
+                logger.warning("malformed PORT_DATA_SET from %s", source)
+        if not port_data_sets:
+            return None
+        return port_data_sets
+
+    def subscribe(self, events, duration):
+        """Ask ptp4l to push the given NOTIFY_* events for duration seconds.
+
+        Notifications go to this client's socket and are read with
+        notification(); the subscription has to be renewed before it
+        expires and is lost when ptp4l restarts.
+        """
+        bitmask = bytearray(EVENT_BITMASK_SIZE)
+        for event in events:
+            bitmask[event // 8] |= 1 << (event % 8)
+        return bool(
+            self.request(
+                SET, SUBSCRIBE_EVENTS_NP, struct.pack(">H", duration) + bitmask
+            )
+        )
+
+    def notification(self, timeout):
+        """Next pushed PortDataSet, TimeStatus or ParentDataSet, None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            with self.lock:
+                try:
+                    self.connect()
+                    self.sock.settimeout(remaining)
+                    message = self.sock.recv(1500)
+                except socket.timeout:
+                    return None
+                except OSError as error:
+                    logger.debug("ptp4l notification failed: %s", error)
+                    return None
+            reply = self.unpack(message)
+            if reply and reply[1] in NOTIFICATIONS:
+                try:
+                    return NOTIFICATIONS[reply[1]](*reply[2:])
+                except struct.error:
+                    logger.warning(
+                        "malformed notification 0x%04x from %s", reply[1], reply[2]
+                    )
+
+    def set_priority1(self, priority1):
+        replies = self.request(SET, PRIORITY1, bytes([priority1, 0]))
+        if not replies:
+            return None
+        return replies[0][1][0]
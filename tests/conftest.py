@@ -0,0 +1,7 @@
+import os
+import sys
+
+# run the e-paper driver against the virtual panel, without delays
+os.environ.setdefault("EPD_BACKEND", "virtual")
+os.environ.setdefault("EPD_VIRTUAL_SPEED", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
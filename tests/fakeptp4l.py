@@ -0,0 +1,180 @@
+"""Stand-in for ptp4l's management socket.
+
+Answers GET/SET requests from canned data sets and pushes notifications
+to subscribers. Messages are packed here with their own layouts rather
+than ptpmgmt's, so the client's parsers are checked against an
+independent encoding.
+"""
+import os
+import socket
+import struct
+import threading
+
+# messageType, versionPTP, messageLength, domainNumber, reserved, flagField,
+# correctionField, reserved, clockIdentity, portNumber, sequenceId,
+# controlField, logMessageInterval
+HEADER = ">BBHBBHq4s8sHHBb"
+# targetPortIdentity, startingBoundaryHops, boundaryHops, actionField, reserved
+MANAGEMENT = ">8sHBBBB"
+HEADER_SIZE = struct.calcsize(HEADER) + struct.calcsize(MANAGEMENT)
+
+CLOCK_DESCRIPTION = 0x0001
+PARENT_DATA_SET = 0x2002
+PORT_DATA_SET = 0x2004
+PRIORITY1 = 0x2005
+TIME_STATUS_NP = 0xC000
+SUBSCRIBE_EVENTS_NP = 0xC003
+
+GET, SET, RESPONSE = 0, 1, 2
+TLV_MANAGEMENT = 0x0001
+TLV_MANAGEMENT_ERROR_STATUS = 0x0002
+NO_SUCH_ID = 0x0002
+
+CLOCK_IDENTITY = bytes.fromhex("b827ebfffe123456")
+GM_IDENTITY = bytes.fromhex("001122fffe334455")
+
+
+def text(value):
+    value = value.encode()
+    return bytes([len(value)]) + value
+
+
+def time_status(master_offset, ingress_time, gm_present=True, gm=GM_IDENTITY):
+    return (
+        struct.pack(">qq", master_offset, ingress_time)
+        + struct.pack(">ii", 0, 0)  # cumulativeScaledRateOffset, scaledLastGm...
+        + struct.pack(">H", 0)  # gmTimeBaseIndicator
+        + bytes(12)  # lastGmPhaseChange
+        + struct.pack(">i", int(gm_present))
+        + gm
+    )
+
+
+def port_data_set(state, clock=CLOCK_IDENTITY, port=1):
+    return (
+        clock
+        + struct.pack(">H", port)
+        + bytes([state])
+        + struct.pack(">b", 0)  # logMinDelayReqInterval
+        + struct.pack(">q", 5 << 16)  # peerMeanPathDelay
+        + struct.pack(">bBbBbB", 1, 3, 0, 1, 0, 2)
+    )
+
+
+def parent_data_set(gm=GM_IDENTITY, priority1=128, priority2=128):
+    return (
+        CLOCK_IDENTITY
+        + struct.pack(">H", 1)
+        + bytes([0, 0])  # parentStats, reserved
+        + struct.pack(">Hi", 0xFFFF, 0x7FFFFFFF)
+        + bytes([priority1, 6, 0x21])  # priority1, clockClass, clockAccuracy
+        + struct.pack(">H", 0x4E5D)  # offsetScaledLogVariance
+        + bytes([priority2])
+        + gm
+    )
+
+
+def clock_description(mac, description, protocol_address=b"\x0a\x00\x00\x01"):
+    return (
+        struct.pack(">H", 0x8000)  # ordinary clock
+        + text("IEEE 802.3")
+        + struct.pack(">H", len(mac))
+        + mac
+        + struct.pack(">HH", 1, len(protocol_address))  # UDP/IPv4
+        + protocol_address
+        + bytes.fromhex("b827eb")
+        + b"\x00"
+        + text(description)
+        + text("1.0;2.0;3.0")
+        + text("")
+        + bytes(6)  # profileIdentity
+    )
+
+
+class FakePtp4l:
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        # managementId -> data returned for GET, missing ids get an error
+        self.data_sets = {
+            TIME_STATUS_NP: time_status(-12, 1_700_000_000_123_456_789),
+            PORT_DATA_SET: port_data_set(9),
+            PARENT_DATA_SET: parent_data_set(),
+            CLOCK_DESCRIPTION: clock_description(
+                CLOCK_IDENTITY[:3] + CLOCK_IDENTITY[5:], "Raspberry;ptp4l;1"
+            ),
+        }
+        self.silent = False
+        self.subscribers = {}
+        self.requests = 0
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def close(self):
+        self.sock.close()
+        os.unlink(self.path)
+
+    def send(self, address, sequence_id, management_id, data, tlv=TLV_MANAGEMENT):
+        if len(data) % 2:
+            data += b"\x00"
+        if tlv == TLV_MANAGEMENT:
+            body = struct.pack(">HHH", tlv, 2 + len(data), management_id) + data
+        else:
+            # errorId first, then the managementId it refers to
+            body = struct.pack(">HHHH", tlv, 8, data[0], management_id) + bytes(4)
+        header = struct.pack(
+            HEADER,
+            0x0D,
+            0x02,
+            HEADER_SIZE + len(body),
+            0,
+            0,
+            0,
+            0,
+            bytes(4),
+            CLOCK_IDENTITY,
+            1,
+            sequence_id,
+            0x04,
+            0x7F,
+        )
+        management = struct.pack(MANAGEMENT, b"\xff" * 8, 0xFFFF, 0, 0, RESPONSE, 0)
+        self.sock.sendto(header + management + body, address)
+
+    def notify(self, management_id, data, sequence_id=0):
+        for address in list(self.subscribers):
+            self.send(address, sequence_id, management_id, data)
+
+    def serve(self):
+        while True:
+            try:
+                message, address = self.sock.recvfrom(1500)
+            except OSError:
+                return
+            self.requests += 1
+            if self.silent:
+                continue
+            sequence_id = struct.unpack_from(HEADER, message)[10]
+            action = struct.unpack_from(MANAGEMENT, message, struct.calcsize(HEADER))[4]
+            _, _, management_id = struct.unpack_from(">HHH", message, HEADER_SIZE)
+            data = message[HEADER_SIZE + 6 :]
+            if action == SET and management_id == SUBSCRIBE_EVENTS_NP:
+                duration = struct.unpack_from(">H", data)[0]
+                self.subscribers[address] = (duration, data[2:66])
+                self.send(address, sequence_id, management_id, data)
+            elif action == SET and management_id == PRIORITY1:
+                self.send(address, sequence_id, management_id, data[:2])
+            elif management_id in self.data_sets:
+                self.send(
+                    address, sequence_id, management_id, self.data_sets[management_id]
+                )
+            else:
+                self.send(
+                    address,
+                    sequence_id,
+                    management_id,
+                    bytes([NO_SUCH_ID]),
+                    TLV_MANAGEMENT_ERROR_STATUS,
+                )
@@ -0,0 +1,256 @@
+import socket
+import struct
+import threading
+
+import pytest
+
+import dhcpprobe
+
+CLIENT_MAC = "b8:27:eb:12:34:56"
+SERVER_MAC = "00:11:22:33:44:55"
+
+
+def server_frame(xid, options, offered_ip="192.168.1.50", source_ip="192.168.1.1"):
+    # a BOOTREPLY from SERVER_MAC, built from a client frame
+    frame = bytearray(dhcpprobe.client_frame(CLIENT_MAC, xid, options))
+    bootp = dhcpprobe.BOOTP_OFFSET
+    frame[6:12] = bytes.fromhex(SERVER_MAC.replace(":", ""))
+    frame[26:30] = socket.inet_aton(source_ip)
+    frame[bootp] = 2
+    frame[bootp + 16 : bootp + 20] = socket.inet_aton(offered_ip)
+    return frame
+
+
+def offer_options(server_ip="192.168.1.1"):
+    return (
+        bytes((dhcpprobe.OPTION_MESSAGE_TYPE, 1, dhcpprobe.OFFER))
+        + bytes((dhcpprobe.OPTION_SERVER_ID, 4))
+        + socket.inet_aton(server_ip)
+        + bytes((dhcpprobe.OPTION_SUBNET_MASK, 4))
+        + socket.inet_aton("255.255.255.0")
+    )
+
+
+def test_client_frame_headers():
+    frame = dhcpprobe.client_frame(CLIENT_MAC, 0x01020304, b"")
+    destination, source, ethertype = dhcpprobe.ETHERNET.unpack_from(frame)
+    assert destination == b"\xff" * 6
+    assert source.hex(":") == CLIENT_MAC and ethertype == dhcpprobe.ETH_P_IP
+    ip = frame[dhcpprobe.ETHERNET.size : dhcpprobe.ETHERNET.size + 20]
+    # a header with a valid checksum sums to zero
+    assert dhcpprobe.ip_checksum(ip) == 0
+    total_length = struct.unpack_from(">H", ip, 2)[0]
+    assert total_length == len(frame) - dhcpprobe.ETHERNET.size
+    udp = dhcpprobe.UDP.unpack_from(frame, dhcpprobe.ETHERNET.size + 20)
+    assert udp == (68, 67, total_length - 20, 0)
+    # padded to the minimum BOOTP size behind the end option
+    assert len(frame) - dhcpprobe.BOOTP_OFFSET == dhcpprobe.BOOTP_MIN_SIZE
+    options = dhcpprobe.BOOTP_OFFSET + dhcpprobe.BOOTP.size
+    assert frame[options : options + 5] == dhcpprobe.MAGIC_COOKIE + b"\xff"
+    assert not any(frame[options + 5 :])
+
+
+def test_client_frame_long_options_not_padded():
+    options = bytes((60, 250)) + bytes(250)
+    frame = dhcpprobe.client_frame(CLIENT_MAC, 1, options)
+    length = dhcpprobe.BOOTP.size + len(dhcpprobe.MAGIC_COOKIE) + len(options) + 1
+    assert len(frame) == dhcpprobe.BOOTP_OFFSET + length
+    assert dhcpprobe.ip_checksum(frame[14:34]) == 0
+
+
+def test_discover_template_patched_xid():
+    template = bytearray(dhcpprobe.discover_template(CLIENT_MAC))
+    template[dhcpprobe.XID_OFFSET : dhcpprobe.XID_OFFSET + 4] = (77).to_bytes(4, "big")
+    assert template == dhcpprobe.client_frame(
+        CLIENT_MAC, 77, bytes((dhcpprobe.OPTION_MESSAGE_TYPE, 1, dhcpprobe.DISCOVER))
+    )
+
+
+def test_parse_reply_round_trip():
+    frame = server_frame(0xDEADBEEF, offer_options())
+    reply = dhcpprobe.parse_reply(memoryview(frame), 123)
+    assert reply == dhcpprobe.Reply(
+        123,
+        dhcpprobe.OFFER,
+        0xDEADBEEF,
+        "192.168.1.1",
+        SERVER_MAC,
+        "192.168.1.50",
+        "255.255.255.0",
+    )
+
+
+def test_request_frame_round_trip():
+    offer = dhcpprobe.parse_reply(server_frame(42, offer_options("10.0.0.1")), 0)
+    frame = dhcpprobe.request_frame(CLIENT_MAC, offer)
+    options = dhcpprobe.BOOTP_OFFSET + dhcpprobe.BOOTP.size + 4
+    assert frame[dhcpprobe.XID_OFFSET : dhcpprobe.XID_OFFSET + 4] == (42).to_bytes(
+        4, "big"
+    )
+    assert frame[options : options + 16] == (
+        bytes((53, 1, dhcpprobe.REQUEST, 50, 4))
+        + socket.inet_aton("192.168.1.50")
+        + bytes((54, 4))
+        + socket.inet_aton("10.0.0.1")
+        + b"\xff"
+    )
+
+
+def test_parse_reply_pads_and_ip_options():
+    options = b"\x00\x00" + offer_options()
+    frame = server_frame(1, options)
+    # an IPv4 header with one word of options moves the BOOTP message
+    frame[14] = 0x46
+    frame[34:34] = b"\x01\x01\x01\x01"
+    reply = dhcpprobe.parse_reply(frame, 0)
+    assert reply.message_type == dhcpprobe.OFFER
+    assert (reply.xid, reply.subnet_mask) == (1, "255.255.255.0")
+
+
+@pytest.mark.parametrize(
+    "options, expected",
+    [
+        # no server identifier: the IP source stands in
+        (bytes((53, 1, dhcpprobe.ACK)), ("192.168.1.1", None)),
+        # a server identifier of the wrong length is ignored
+        (bytes((53, 1, 2, 54, 3, 10, 0, 0)), ("192.168.1.1", None)),
+        # options after the end option are not read
+        (bytes((53, 1, 2, 255, 1, 4, 255, 255, 0, 0)), ("192.168.1.1", None)),
+    ],
+)
+def test_parse_reply_options(options, expected):
+    reply = dhcpprobe.parse_reply(server_frame(1, options), 0)
+    assert (reply.server_ip, reply.subnet_mask) == expected
+
+
+def test_parse_reply_truncated_option():
+    frame = server_frame(1, offer_options())
+    options = dhcpprobe.BOOTP_OFFSET + dhcpprobe.BOOTP.size + 4
+    # cut inside the server identifier, and inside its length byte
+    for cut in (options + 3 + 4, options + 3 + 1):
+        reply = dhcpprobe.parse_reply(frame[:cut], 0)
+        assert reply.message_type == dhcpprobe.OFFER
+        assert reply.server_ip == "192.168.1.1" and reply.subnet_mask is None
+
+
+def test_parse_reply_rejects():
+    frame = server_frame(1, offer_options())
+    options = dhcpprobe.BOOTP_OFFSET + dhcpprobe.BOOTP.size
+    assert dhcpprobe.parse_reply(frame[: options + 3], 0) is None
+    request = bytearray(frame)
+    request[dhcpprobe.BOOTP_OFFSET] = 1
+    assert dhcpprobe.parse_reply(request, 0) is None
+    cookie = bytearray(frame)
+    cookie[options] = 0
+    assert dhcpprobe.parse_reply(cookie, 0) is None
+    # no message type option
+    assert (
+        dhcpprobe.parse_reply(server_frame(1, bytes((1, 4, 255, 0, 0, 0))), 0) is None
+    )
+
+
+def run_filter(program, packet):
+    # the classic BPF instructions used by DHCP_FILTER
+    a = x = pc = 0
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code == 0x28:
+            a = struct.unpack_from(">H", packet, k)[0]
+        elif code == 0x30:
+            a = packet[k]
+        elif code == 0xB1:
+            x = 4 * (packet[k] & 0x0F)
+        elif code == 0x48:
+            a = struct.unpack_from(">H", packet, x + k)[0]
+        elif code == 0x15:
+            pc += jt if a == k else jf
+        elif code == 0x45:
+            pc += jt if a & k else jf
+        elif code == 0x06:
+            return k
+        else:
+            raise ValueError("unexpected BPF instruction %#x" % code)
+
+
+def test_filter_jumps_stay_in_program():
+    program = dhcpprobe.DHCP_FILTER
+    for pc, (code, jt, jf, k) in enumerate(program):
+        # BPF_JMP class; jumps are relative to the next instruction
+        if code & 0x07 == 0x05:
+            assert pc + 1 + max(jt, jf) < len(program)
+        else:
+            assert jt == jf == 0
+    assert program[-1] == (0x06, 0, 0, 0)
+
+
+def test_filter_accepts_dhcp_only():
+    accept = dhcpprobe.DHCP_FILTER[-2][3]
+    frame = server_frame(1, offer_options())
+    assert run_filter(dhcpprobe.DHCP_FILTER, frame) == accept
+    client = dhcpprobe.discover_template(CLIENT_MAC)
+    assert run_filter(dhcpprobe.DHCP_FILTER, client) == accept
+    with_options = bytearray(frame)
+    with_options[14] = 0x46
+    with_options[34:34] = bytes(4)
+    assert run_filter(dhcpprobe.DHCP_FILTER, with_options) == accept
+
+    def changed(offset, value):
+        packet = bytearray(frame)
+        packet[offset : offset + len(value)] = value
+        return packet
+
+    rejected = [
+        changed(12, b"\x86\xdd"),  # IPv6
+        changed(23, bytes((socket.IPPROTO_TCP,))),
+        changed(20, b"\x00\x10"),  # a later fragment
+        changed(34, struct.pack(">HH", 53, 5353)),  # DNS
+    ]
+    for packet in rejected:
+        assert run_filter(dhcpprobe.DHCP_FILTER, packet) == 0
+    # the first fragment still carries the UDP header
+    assert run_filter(dhcpprobe.DHCP_FILTER, changed(20, b"\x20\x00")) == accept
+
+
+class FlakySocket:
+    # a socket whose first receive fails like a downed interface
+    def __init__(self, frames, fail):
+        self.frames = frames
+        self.fail = fail
+        self.closed = False
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recvmsg_into(self, buffers, ancbufsize):
+        if self.fail:
+            self.fail = False
+            raise OSError(100, "Network is down")
+        if not self.frames:
+            threading.Event().wait(self.timeout)
+            raise socket.timeout
+        frame = self.frames.pop(0)
+        buffers[0][: len(frame)] = frame
+        return len(frame), [], 0, ("eth0", 0x0800, socket.PACKET_HOST, 1, b"")
+
+    def close(self):
+        self.closed = True
+
+
+def test_monitor_reopens_socket(monkeypatch):
+    offer = server_frame(9, offer_options())
+    sockets = [FlakySocket([], fail=True), FlakySocket([offer], fail=False)]
+    opened = list(sockets)
+    monkeypatch.setattr(dhcpprobe, "open_socket", lambda ifname: opened.pop(0))
+    received = threading.Event()
+    replies = []
+
+    def on_reply(reply):
+        replies.append(reply)
+        received.set()
+
+    monitor = dhcpprobe.Monitor("eth0", on_reply, retry_interval=0)
+    monitor.start()
+    assert received.wait(5)
+    assert replies[0].xid == 9
+    assert monitor.errors == 1 and sockets[0].closed
@@ -0,0 +1,19 @@
+import dhcpprobe
+import dhcpservers
+
+
+def test_reply_seen_twice_counts_once():
+    table = dhcpservers.ServerTable()
+    offer = ("192.168.1.1", "00:11:22:33:44:55", dhcpprobe.OFFER)
+    lease = ("192.168.1.50", "255.255.255.0")
+    assert table.update(*offer, *lease, 10.0, xid=7)
+    # the same OFFER handed over by the monitor and by a scan
+    assert not table.update(*offer, *lease, 11.0, xid=7)
+    table.update(*offer, *lease, 12.0, xid=8)
+    table.update(offer[0], offer[1], dhcpprobe.ACK, *lease, 13.0, xid=8)
+    (server,) = table.snapshot()
+    assert (server["offers"], server["acks"]) == (2, 1)
+    assert server["last_seen"] == 13.0
+    assert server["offered_subnet"] == "192.168.1.0/24"
+    table.expire(14.0)
+    assert table.snapshot() == [] and table.transactions == {}
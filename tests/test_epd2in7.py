@@ -0,0 +1,176 @@
+import random
+
+import pytest
+from PIL import Image
+
+import epd2in7
+
+GRAYS = (epd2in7.GRAY1, epd2in7.GRAY2, epd2in7.GRAY3, epd2in7.GRAY4)
+
+
+def loop_getbuffer_4Gray(epd, image):
+    # the original per-pixel implementation
+    buf = [0xFF] * (int(epd.width / 4) * epd.height)
+    image_monocolor = image.convert("L")
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    i = 0
+    if imwidth == epd.width and imheight == epd.height:
+        for y in range(imheight):
+            for x in range(imwidth):
+                if pixels[x, y] == 0xC0:
+                    pixels[x, y] = 0x80
+                elif pixels[x, y] == 0x80:
+                    pixels[x, y] = 0x40
+                i = i + 1
+                if i % 4 == 0:
+                    buf[int((x + (y * epd.width)) / 4)] = (
+                        (pixels[x - 3, y] & 0xC0)
+                        | (pixels[x - 2, y] & 0xC0) >> 2
+                        | (pixels[x - 1, y] & 0xC0) >> 4
+                        | (pixels[x, y] & 0xC0) >> 6
+                    )
+    elif imwidth == epd.height and imheight == epd.width:
+        for x in range(imwidth):
+            for y in range(imheight):
+                newx = y
+                newy = epd.height - x - 1
+                if pixels[x, y] == 0xC0:
+                    pixels[x, y] = 0x80
+                elif pixels[x, y] == 0x80:
+                    pixels[x, y] = 0x40
+                i = i + 1
+                if i % 4 == 0:
+                    buf[int((newx + (newy * epd.width)) / 4)] = (
+                        (pixels[x, y - 3] & 0xC0)
+                        | (pixels[x, y - 2] & 0xC0) >> 2
+                        | (pixels[x, y - 1] & 0xC0) >> 4
+                        | (pixels[x, y] & 0xC0) >> 6
+                    )
+    return buf
+
+
+def loop_planes_4Gray(image):
+    # the bytes the original display_4Gray sent after 0x10 and 0x13
+    planes = []
+    for light_gray, dark_gray in ((0x01, 0x00), (0x00, 0x01)):
+        plane = bytearray()
+        for i in range(0, 5808):
+            temp3 = 0
+            for j in range(0, 2):
+                temp1 = image[i * 2 + j]
+                for k in range(0, 2):
+                    for half in range(2):
+                        temp2 = temp1 & 0xC0
+                        if temp2 == 0xC0:
+                            temp3 |= 0x01
+                        elif temp2 == 0x80:
+                            temp3 |= light_gray
+                        elif temp2 == 0x40:
+                            temp3 |= dark_gray
+                        if half == 0 or j != 1 or k != 1:
+                            temp3 <<= 1
+                        temp1 <<= 2
+            plane.append(temp3)
+        planes.append(bytes(plane))
+    return planes
+
+
+def sample(size, levels, seed):
+    generator = random.Random(seed)
+    image = Image.new("L", size)
+    image.putdata([generator.choice(levels) for _ in range(size[0] * size[1])])
+    return image
+
+
+@pytest.fixture
+def epd():
+    return epd2in7.EPD()
+
+
+def sent_planes(epd, buf):
+    # capture the data following each command of display_4Gray
+    planes = {}
+    command = None
+    send_command, send_data2 = epd.send_command, epd.send_data2
+
+    def record_command(value):
+        nonlocal command
+        command = value
+        send_command(value)
+
+    def record_data(data):
+        planes[command] = bytes(data)
+        send_data2(data)
+
+    epd.send_command, epd.send_data2 = record_command, record_data
+    epd.display_4Gray(buf)
+    return planes[0x10], planes[0x13]
+
+
+@pytest.mark.parametrize("vertical", [True, False])
+@pytest.mark.parametrize("levels", [GRAYS, range(256)])
+def test_4gray_matches_loops(epd, vertical, levels):
+    size = (epd.width, epd.height) if vertical else (epd.height, epd.width)
+    image = sample(size, levels, seed=len(levels) + vertical)
+    expected = loop_getbuffer_4Gray(epd, image)
+    buf = epd.getbuffer_4Gray(image)
+    assert bytes(buf) == bytes(expected)
+    assert sent_planes(epd, buf) == tuple(loop_planes_4Gray(expected))
+
+
+def test_4gray_unsupported_size(epd):
+    image = sample((100, 100), GRAYS, seed=0)
+    assert bytes(epd.getbuffer_4Gray(image)) == bytes(loop_getbuffer_4Gray(epd, image))
+
+
+def frame_bytes():
+    return epd2in7.epdconfig.frame_image().tobytes()
+
+
+def test_virtual_display_cycle(epd):
+    epdconfig = epd2in7.epdconfig
+    frame_size = epd.width * epd.height // 8
+    assert epd.init() == 0
+    assert epdconfig.digital_read(epdconfig.PWR_PIN) == 1
+
+    frame = bytes(random.Random(3).randrange(256) for _ in range(frame_size))
+    epd.display(frame)
+    assert frame_bytes() == frame
+    chunks = -(-frame_size // epdconfig.RaspberryPi.SPI_CHUNK)
+    # three commands and two planes, each write framed by DC and CS
+    assert epd.frame_counters == {
+        "calls": 3 + 2 * chunks,
+        "bytes": 3 + 2 * frame_size,
+        "pin_writes": 5 * 3,
+    }
+
+    x, y, w, l = 16, 40, 32, 3
+    window = bytes(range(w * l // 8))
+    epd.display_window(window, x, y, w, l)
+    expected = bytearray(frame)
+    for row in range(l):
+        start = (y + row) * epd.width // 8 + x // 8
+        expected[start : start + w // 8] = window[row * w // 8 : (row + 1) * w // 8]
+    assert frame_bytes() == expected
+    # 8 byte header before both planes and as the refresh's payload
+    assert epd.frame_counters == {
+        "calls": 6,
+        "bytes": 3 + 2 * (8 + len(window)) + 8,
+        "pin_writes": 6 * 3,
+    }
+
+    epdconfig.spi_counters(reset=True)
+    epd.sleep()
+    counters = epdconfig.spi_counters()
+    assert counters["calls"] == 5 and counters["bytes"] == 5
+    assert epdconfig.digital_read(epdconfig.PWR_PIN) == 0
+    # the panel keeps showing the last frame in deep sleep
+    assert frame_bytes() == expected
+
+
+def test_virtual_clear(epd):
+    epd.init()
+    epd.display(bytes(epd.width * epd.height // 8))
+    epd.Clear()
+    assert set(frame_bytes()) == {0xFF}
@@ -0,0 +1,143 @@
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+import epd2in7
+import epdpanel
+
+LINE_WIDTH = epd2in7.EPD_WIDTH // 8
+
+
+@pytest.fixture
+def panel():
+    epd = epd2in7.EPD()
+    calls = []
+    display, display_window = epd.display, epd.display_window
+
+    def record_display(frame):
+        calls.append("full")
+        display(frame)
+
+    def record_window(window, *geometry):
+        calls.append(geometry)
+        display_window(window, *geometry)
+
+    epd.display, epd.display_window = record_display, record_window
+    panel = epdpanel.Panel(epd, idle_timeout=3600)
+    panel.calls = calls
+    yield panel
+    if panel.sleep_timer:
+        panel.sleep_timer.cancel()
+
+
+def blank():
+    # landscape, as program.py draws its views
+    return Image.new("1", (epd2in7.EPD_HEIGHT, epd2in7.EPD_WIDTH), 255)
+
+
+def shown_frame():
+    return epd2in7.epdconfig.frame_image().tobytes()
+
+
+def test_dirty_ranges():
+    old = bytes(20)
+    new = bytearray(old)
+    new[2:4] = b"\x01\x01"
+    new[7] = 1
+    new[19] = 1
+    assert epdpanel.dirty_ranges(old, new) == [(2, 4), (7, 8), (19, 20)]
+    assert epdpanel.dirty_ranges(old, old) == []
+
+
+def test_changed_window_byte_aligned(panel):
+    # bytes 3..5 of row 5: pixels 24..47
+    start = 5 * LINE_WIDTH + 3
+    assert panel.changed_window([(start, start + 3)]) == (24, 5, 24, 1)
+    # two rows, the union of their columns
+    ranges = [
+        (5 * LINE_WIDTH + 3, 5 * LINE_WIDTH + 4),
+        (9 * LINE_WIDTH + 10, 9 * LINE_WIDTH + 12),
+    ]
+    assert panel.changed_window(ranges) == (24, 5, 72, 5)
+
+
+def test_changed_window_range_spanning_rows(panel):
+    # a range wrapping into the next row covers whole lines
+    start = 5 * LINE_WIDTH + LINE_WIDTH - 1
+    assert panel.changed_window([(start, start + 2)]) == (0, 5, epd2in7.EPD_WIDTH, 2)
+
+
+def test_small_change_refreshes_window(panel):
+    image = blank()
+    panel.show(image)
+    ImageDraw.Draw(image).rectangle((100, 50, 120, 60), fill=0)
+    panel.show(image)
+    assert panel.calls[0] == "full"
+    x, y, w, l = panel.calls[1]
+    assert x % 8 == 0 and w % 8 == 0
+    assert w * l < epd2in7.EPD_WIDTH * epd2in7.EPD_HEIGHT // 2
+    assert shown_frame() == panel.epd.getbuffer(image)
+    # the same frame again is not sent at all
+    panel.show(image)
+    assert len(panel.calls) == 2
+
+
+def test_large_change_refreshes_full(panel):
+    image = blank()
+    panel.show(image)
+    ImageDraw.Draw(image).rectangle((0, 0, 200, 150), fill=0)
+    panel.show(image)
+    assert panel.calls == ["full", "full"]
+    assert panel.partial_refresh_count == 0
+
+
+def test_full_refresh_cadence(panel):
+    image = blank()
+    panel.show(image)
+    draw = ImageDraw.Draw(image)
+    for step in range(12):
+        draw.point((10 + step, 10), fill=0)
+        panel.show(image)
+    kinds = ["full" if call == "full" else "window" for call in panel.calls]
+    assert kinds == ["full"] + ["window"] * 10 + ["full", "window"]
+    assert panel.partial_refresh_count == 1
+
+
+def test_partial_updates_match_full_frame(panel):
+    generator = random.Random(4)
+    image = blank()
+    draw = ImageDraw.Draw(image)
+    for _ in range(30):
+        x = generator.randrange(image.width - 40)
+        y = generator.randrange(image.height - 20)
+        size = generator.randrange(1, 40)
+        draw.rectangle((x, y, x + size, y + size // 2), fill=generator.choice((0, 255)))
+        panel.show(image)
+        assert shown_frame() == panel.epd.getbuffer(image)
+    assert "full" in panel.calls[1:]
+    assert any(call != "full" for call in panel.calls)
+
+
+def test_busy_timeout_reinitialises(panel):
+    image = blank()
+    panel.show(image)
+    display_window = panel.epd.display_window
+
+    def hang(*args):
+        raise TimeoutError("e-Paper busy for more than 30 s")
+
+    inits = []
+    init = panel.epd.init
+    panel.epd.init = lambda: inits.append(1) or init()
+    panel.epd.display_window = hang
+    ImageDraw.Draw(image).point((10, 10), fill=0)
+    with pytest.raises(TimeoutError):
+        panel.show(image)
+    assert not panel.awake and panel.last_frame is None
+    assert panel.sleep_timer.is_alive()
+    panel.epd.display_window = display_window
+    panel.show(image)
+    assert inits == [1]
+    assert panel.calls[-1] == "full"
+    assert shown_frame() == panel.epd.getbuffer(image)
@@ -0,0 +1,125 @@
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+import epd2in7
+import epdview
+
+DHCP_CLIENT = {
+    "dhcp_server_active": False,
+    "my_ip": "192.168.1.23",
+    "leases": None,
+    "foreign_dhcp_server": "192.168.1.1",
+    "carrier": True,
+}
+PTP_SLAVE = {
+    "foreign_master": True,
+    "current_master": "00:11:22:33:44:55",
+    "master_description": "Meinberg M600",
+    "current_time": "2026-10-18 12:00:00.123456",
+    "current_offset": -12,
+    "clock_count": 3,
+    "discipline_converged": True,
+    "residual_offset": 37,
+}
+
+DHCP_VIEWS = {
+    "server with leases": (
+        dict(
+            DHCP_CLIENT,
+            dhcp_server_active=True,
+            my_ip="10.0.0.1",
+            leases=["10.0.0.50 b8:27:eb:00:00:01", "10.0.0.51 b8:27:eb:00:00:02"],
+            foreign_dhcp_server=None,
+        ),
+        None,
+    ),
+    "server without leases": (
+        dict(DHCP_CLIENT, dhcp_server_active=True, foreign_dhcp_server=None),
+        None,
+    ),
+    "client": (DHCP_CLIENT, None),
+    "client without server": (
+        dict(DHCP_CLIENT, my_ip=None, foreign_dhcp_server=None),
+        None,
+    ),
+    "client without link": (dict(DHCP_CLIENT, carrier=False), None),
+    "client measured": (DHCP_CLIENT, "3.1/7.9 ms, loss 0%"),
+}
+PTP_VIEWS = {
+    "master": (dict(PTP_SLAVE, foreign_master=False), True, False),
+    "slave": (PTP_SLAVE, False, False),
+    "slave without master": (dict(PTP_SLAVE, foreign_master=False), False, False),
+    "disciplining locked": (PTP_SLAVE, False, True),
+    "disciplining converging": (
+        dict(PTP_SLAVE, discipline_converged=False),
+        False,
+        True,
+    ),
+    "master not responding": (None, True, False),
+    "slave not responding": (None, False, False),
+}
+
+
+def single_text(labels, header, fields):
+    # the views as drawn before label_strip and view_template: the labels
+    # and one draw.text of all captions and values on a fresh image
+    font = epdview.font
+    image = Image.new("1", (epd2in7.EPD_HEIGHT, epd2in7.EPD_WIDTH), 255)
+    button_labels = Image.new("1", (176, font.size + 10), 255)
+    button_labels_draw = ImageDraw.Draw(button_labels)
+    for index, label in enumerate(labels):
+        button_labels_draw.text((22 + 44 * index, 5), label, font=font, anchor="ma")
+    for index in range(4):
+        button_labels_draw.rectangle([44 * index, 0, 44 * index + 44, font.size + 10])
+    image.paste(button_labels.rotate(-90, expand=1), (0, 0))
+    response = "\n".join(
+        [header] + [f"{caption}\n{value}" for caption, value in fields]
+    )
+    ImageDraw.Draw(image).text((font.size + 20, 10), response, font=font)
+    return image
+
+
+def assert_same_pixels(view):
+    image = epdview.draw_view(*view)
+    expected = single_text(*view)
+    assert image.size == expected.size
+    assert ImageChops.difference(image, expected).getbbox() is None
+
+
+@pytest.mark.parametrize("name", DHCP_VIEWS)
+def test_dhcp_view_matches_single_text(name):
+    info, response_time = DHCP_VIEWS[name]
+    assert_same_pixels(epdview.dhcp_view(info, response_time))
+
+
+@pytest.mark.parametrize("name", PTP_VIEWS)
+def test_ptp_view_matches_single_text(name):
+    assert_same_pixels(epdview.ptp_view(*PTP_VIEWS[name]))
+
+
+def test_view_content():
+    labels, header, fields = epdview.dhcp_view(*DHCP_VIEWS["client measured"])
+    assert labels[2] == "Measure"
+    assert fields[-1] == ("Response time (median/p99):", "3.1/7.9 ms, loss 0%")
+    labels, header, fields = epdview.ptp_view(*PTP_VIEWS["disciplining converging"])
+    assert labels == ("Refresh", "DHCP", "Master", "Free")
+    assert header == "Disciplining clock (converging)"
+    assert ("Residual offset:", "37ns") in fields
+
+
+def test_template_is_not_modified():
+    view = epdview.ptp_view(*PTP_VIEWS["slave"])
+    first = epdview.draw_view(*view)
+    epdview.draw_view(view[0], view[1], [(caption, "X" * 20) for caption, _ in view[2]])
+    assert ImageChops.difference(first, epdview.draw_view(*view)).getbbox() is None
+
+
+def test_missing_font_falls_back():
+    assert epdview.load_font("/nonexistent/font.ttf").getbbox("A")
+
+
+def test_ptp4l_not_responding():
+    labels, header, fields = epdview.ptp_view(None, False, True)
+    assert labels == ("Refresh", "DHCP", "Master", "Free")
+    assert header == "Working as PTP slave\n(ptp4l not responding)"
+    assert fields == ()
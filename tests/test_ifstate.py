@@ -0,0 +1,184 @@
+import errno
+import queue
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+import ifstate
+
+
+def rtattr(kind, data):
+    attribute = ifstate.RTATTR.pack(ifstate.RTATTR.size + len(data), kind) + data
+    return attribute + bytes(ifstate.align(len(attribute)) - len(attribute))
+
+
+def nlmsg(kind, payload, sequence=0):
+    message = ifstate.NLMSGHDR.pack(
+        ifstate.NLMSGHDR.size + len(payload), kind, 0, sequence, 0
+    )
+    message += payload
+    return message + bytes(ifstate.align(len(message)) - len(message))
+
+
+def link(index, name, flags=ifstate.IFF_UP | ifstate.IFF_LOWER_UP):
+    return ifstate.IFINFOMSG.pack(socket.AF_UNSPEC, 1, index, flags, 0) + rtattr(
+        ifstate.IFLA_IFNAME, name.encode() + b"\x00"
+    )
+
+
+def address(ip, prefix_length, index, valid=None, scope=ifstate.RT_SCOPE_UNIVERSE):
+    flags = ifstate.IFA_F_PERMANENT if valid is None else 0
+    payload = ifstate.IFADDRMSG.pack(socket.AF_INET, prefix_length, flags, scope, index)
+    payload += rtattr(ifstate.IFA_ADDRESS, socket.inet_aton(ip))
+    payload += rtattr(ifstate.IFA_LOCAL, socket.inet_aton(ip))
+    if valid is not None:
+        payload += rtattr(
+            ifstate.IFA_CACHEINFO, ifstate.IFA_CACHEINFO_DATA.pack(valid, valid, 0, 0)
+        )
+    return payload
+
+
+def error(code):
+    # nlmsgerr: negative errno and the offending request's header
+    return struct.pack("=i", -code) + bytes(ifstate.NLMSGHDR.size)
+
+
+class FakeNetlink:
+    # answers RTM_GETLINK/RTM_GETADDR dumps from the links and addresses
+    # lists; failures holds errnos to answer the next dumps with
+    def __init__(self, links, addresses, failures=()):
+        self.links = links
+        self.addresses = addresses
+        self.failures = list(failures)
+        self.datagrams = queue.Queue()
+
+    def send(self, request):
+        _, kind, _, sequence, _ = ifstate.NLMSGHDR.unpack_from(request)
+        if self.failures:
+            self.datagrams.put(nlmsg(ifstate.NLMSG_ERROR, error(self.failures.pop(0))))
+            return
+        messages = (
+            [nlmsg(ifstate.RTM_NEWLINK, payload, sequence) for payload in self.links]
+            if kind == ifstate.RTM_GETLINK
+            else [
+                nlmsg(ifstate.RTM_NEWADDR, payload, sequence)
+                for payload in self.addresses
+            ]
+        )
+        self.datagrams.put(b"".join(messages))
+        self.datagrams.put(nlmsg(ifstate.NLMSG_DONE, struct.pack("=i", 0), sequence))
+
+    def recv(self, size):
+        datagram = self.datagrams.get()
+        if isinstance(datagram, OSError):
+            raise datagram
+        return datagram
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+@pytest.fixture
+def state():
+    state = ifstate.InterfaceState("eth0", retry_interval=0)
+    state.sock.close()
+    return state
+
+
+def test_messages_alignment_and_truncation():
+    # a 3 byte payload is padded to the next 4 byte boundary
+    data = nlmsg(ifstate.RTM_NEWLINK, b"abc") + nlmsg(ifstate.NLMSG_DONE, b"\x00" * 4)
+    assert list(ifstate.messages(data)) == [
+        (ifstate.RTM_NEWLINK, b"abc"),
+        (ifstate.NLMSG_DONE, b"\x00" * 4),
+    ]
+    # a header cut short and a message claiming less than a header end it
+    assert list(ifstate.messages(data[:-10])) == [(ifstate.RTM_NEWLINK, b"abc")]
+    bogus = ifstate.NLMSGHDR.pack(4, ifstate.RTM_NEWADDR, 0, 0, 0)
+    assert list(ifstate.messages(bogus + data)) == []
+
+
+def test_attributes():
+    data = b"skip" + rtattr(3, b"eth0\x00") + rtattr(0x8000 | 6, b"x")
+    assert ifstate.attributes(data, 4) == {3: b"eth0\x00", 6: b"x"}
+    # a length shorter than the header stops the walk
+    data = rtattr(1, b"abcd") + ifstate.RTATTR.pack(2, 2) + rtattr(3, b"z")
+    assert ifstate.attributes(data, 0) == {1: b"abcd"}
+
+
+def test_update_link(state):
+    assert not state.update_link(ifstate.RTM_NEWLINK, link(7, "wlan0"))
+    assert state.update_link(ifstate.RTM_NEWLINK, link(2, "eth0"))
+    assert (state.index, state.carrier) == (2, True)
+    assert not state.update_link(ifstate.RTM_NEWLINK, link(2, "eth0"))
+    assert state.update_link(ifstate.RTM_NEWLINK, link(2, "eth0", ifstate.IFF_UP))
+    assert state.carrier is False
+    state.update_link(ifstate.RTM_NEWLINK, link(2, "eth0"))
+    assert state.update_link(ifstate.RTM_DELLINK, link(2, "eth0"))
+    assert state.carrier is False
+
+
+def test_update_address_and_lease(state):
+    state.update_link(ifstate.RTM_NEWLINK, link(2, "eth0"))
+    # another interface's address, and a link local one
+    assert not state.update_address(ifstate.RTM_NEWADDR, address("10.9.9.9", 8, 3))
+    assert state.update_address(
+        ifstate.RTM_NEWADDR, address("169.254.1.1", 16, 2, scope=253)
+    )
+    assert state.address() is None and state.lease() is None
+    assert state.update_address(ifstate.RTM_NEWADDR, address("10.0.0.1", 24, 2))
+    assert state.address() == "10.0.0.1" and state.lease() is None
+    assert state.update_address(
+        ifstate.RTM_NEWADDR, address("192.168.1.23", 24, 2, valid=3600)
+    )
+    # the DHCP lease wins over the static address
+    assert state.address() == "192.168.1.23"
+    assert state.lease() == ("192.168.1.23/24", 3600)
+    # a renewal only moves the lifetime
+    assert not state.update_address(
+        ifstate.RTM_NEWADDR, address("192.168.1.23", 24, 2, valid=7200)
+    )
+    assert state.lease()[1] == 7200
+    assert state.update_address(
+        ifstate.RTM_DELADDR, address("192.168.1.23", 24, 2, valid=0)
+    )
+    assert state.address() == "10.0.0.1" and state.lease() is None
+
+
+def test_receive_raises_netlink_error(state):
+    state.sock = FakeNetlink([], [])
+    state.sock.datagrams.put(nlmsg(ifstate.NLMSG_ERROR, error(errno.EBUSY)))
+    with pytest.raises(OSError) as raised:
+        state.receive()
+    assert raised.value.errno == errno.EBUSY
+
+
+def test_start_and_reload_survive_errors(state):
+    changes = []
+    state.on_change = lambda: changes.append(state.address())
+    # the dump at start fails, and so does the first reload on the thread
+    state.sock = FakeNetlink(
+        [link(2, "eth0")],
+        [address("192.168.1.23", 24, 2, valid=600)],
+        failures=[errno.EBUSY, errno.EBUSY],
+    )
+    state.start()
+    assert wait_for(lambda: not state.stale)
+    assert state.address() == "192.168.1.23"
+    assert changes == [None, "192.168.1.23"]
+    # dropped notifications reload everything, a failing reload is retried
+    state.sock.addresses = [address("192.168.1.24", 24, 2, valid=600)]
+    state.sock.failures = [errno.EBUSY]
+    state.sock.datagrams.put(OSError(errno.ENOBUFS, "No buffer space available"))
+    assert wait_for(lambda: "192.168.1.24" in changes and not state.stale)
+    assert state.address() == "192.168.1.24"
+    assert state.thread.is_alive()
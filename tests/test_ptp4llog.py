@@ -0,0 +1,84 @@
+import io
+import os
+
+import ptp4llog
+
+# five minutes of `ptp4l -m` output: lock, a port fault, a clock jump and
+# the takeover as grand master
+LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ptp4l.log")
+
+
+def read_log():
+    with open(LOG) as log:
+        return log.read().splitlines(keepends=True)
+
+
+def test_parse_line():
+    sample = ptp4llog.parse_line(
+        "ptp4l[14.160]: master offset   -2843211 s0 freq      +0 path delay     41230",
+        now=1.5,
+    )
+    assert sample == ptp4llog.ServoSample(1.5, -2843211, 0, 0, 41230)
+    event = ptp4llog.parse_line(
+        "ptp4l[156.549]: port 1 (eth0): SLAVE to FAULTY on FAULT_DETECTED "
+        "(FT_UNSPECIFIED)",
+        now=2.5,
+    )
+    assert event == ptp4llog.PortEvent(
+        2.5, 1, "eth0", "SLAVE", "FAULTY", "FAULT_DETECTED"
+    )
+    # releases before 2.0 leave out the interface
+    event = ptp4llog.parse_line("ptp4l[9.1]: port 1: LISTENING to MASTER on RS_MASTER")
+    assert (event.port, event.interface, event.new_state) == (1, None, "MASTER")
+    for line in (
+        "ptp4l[13.212]: selected best master clock 001122.fffe.334455",
+        "ptp4l[348.571]: selected local clock b827eb.fffe.123456 as best master",
+        "ptp4l[156.1]: increasing tx_timestamp_timeout may correct this issue",
+    ):
+        assert ptp4llog.parse_line(line) is None
+
+
+def test_log_fixture():
+    samples, events = [], []
+    reader = ptp4llog.LogReader(io.StringIO("".join(read_log())), samples.append)
+    reader.on_port_event = events.append
+    reader.run()
+    assert reader.lines == 325
+    assert len(samples) == 305
+    assert [sample.state for sample in samples[:3]] == [0, 1, 2]
+    assert samples[-1].path_delay > 0
+    assert [(event.port, event.new_state) for event in events] == [
+        (1, "LISTENING"),
+        (0, "LISTENING"),
+        (1, "UNCALIBRATED"),
+        (1, "SLAVE"),
+        (1, "FAULTY"),
+        (1, "LISTENING"),
+        (1, "UNCALIBRATED"),
+        (1, "SLAVE"),
+        (1, "LISTENING"),
+        (1, "MASTER"),
+    ]
+
+
+def test_multi_hour_log():
+    # the fixture repeated to six hours of once-per-second servo output;
+    # benchmarks/bench_ptp4llog.py times it
+    lines = read_log()
+    repeats = 6 * 3600 // 305 + 1
+    stream = io.StringIO("".join(lines * repeats))
+    counts = {"samples": 0, "events": 0, "closed": False}
+
+    def on_sample(sample):
+        counts["samples"] += 1
+
+    def on_port_event(event):
+        counts["events"] += 1
+
+    def on_close():
+        counts["closed"] = True
+
+    reader = ptp4llog.LogReader(stream, on_sample, on_port_event, on_close)
+    reader.run()
+    assert counts == {"samples": 305 * repeats, "events": 10 * repeats, "closed": True}
+    assert reader.lines == 325 * repeats
@@ -0,0 +1,93 @@
+import math
+import random
+import statistics
+
+import pytest
+
+import ptphistory
+
+
+def brute_adev(x, m, tau0):
+    # overlapping Allan deviation from phase samples x (ns), tau = m * tau0
+    n = len(x)
+    total = sum((x[i + 2 * m] - 2 * x[i + m] + x[i]) ** 2 for i in range(n - 2 * m))
+    tau = m * tau0
+    return math.sqrt(total / (2 * tau**2 * (n - 2 * m))) / 1e9
+
+
+def brute_tdev(x, m):
+    # time deviation in ns, from the modified Allan variance definition
+    n = len(x)
+    total = 0
+    for j in range(n - 3 * m + 1):
+        inner = sum(x[i + 2 * m] - 2 * x[i + m] + x[i] for i in range(j, j + m))
+        total += inner**2
+    return math.sqrt(total / (6 * m**2 * (n - 3 * m + 1)))
+
+
+def fill(history, count, seed=1):
+    generator = random.Random(seed)
+    samples = []
+    for i in range(count):
+        sample = (
+            1000.0 + i,
+            round(generator.gauss(0, 100)),
+            round(generator.gauss(5000, 10)),
+            round(generator.gauss(-20000, 50)),
+        )
+        history.push(*sample)
+        samples.append(sample)
+    return samples
+
+
+@pytest.mark.parametrize("count", [250, 5000])
+def test_statistics_match_brute_force(count):
+    history = ptphistory.History(capacity=3000, interval=2, taus=(1, 10, 100))
+    samples = fill(history, count)[-3000:]
+    offsets = [sample[1] for sample in samples]
+    snapshot = history.snapshot()
+
+    assert snapshot["sample_count"] == len(samples)
+    for position, field in enumerate(("offset", "path_delay", "frequency"), 1):
+        values = [sample[position] for sample in samples]
+        summary = snapshot["statistics"][field]
+        assert summary["mean"] == pytest.approx(statistics.fmean(values))
+        assert summary["stddev"] == pytest.approx(statistics.stdev(values))
+        rms = math.sqrt(sum(value**2 for value in values) / len(values))
+        assert summary["rms"] == pytest.approx(rms)
+
+    taus = (1, 10, 100)
+    assert set(snapshot["adev"]) == {2 * m for m in taus if len(offsets) > 2 * m}
+    assert set(snapshot["tdev"]) == {2 * m for m in taus if len(offsets) >= 3 * m}
+    for m in taus:
+        if 2 * m in snapshot["adev"]:
+            assert snapshot["adev"][2 * m] == pytest.approx(brute_adev(offsets, m, 2))
+        if 2 * m in snapshot["tdev"]:
+            assert snapshot["tdev"][2 * m] == pytest.approx(brute_tdev(offsets, m))
+
+
+def test_white_phase_noise_adev_slope():
+    # white phase noise: ADEV falls as 1/tau, sqrt(3) * sigma / tau
+    history = ptphistory.History(capacity=20000, interval=1, taus=(1, 10, 100))
+    fill(history, 20000, seed=7)
+    adev = history.snapshot()["adev"]
+    for tau in (1, 10, 100):
+        assert adev[tau] * tau == pytest.approx(math.sqrt(3) * 100e-9, rel=0.1)
+
+
+def test_series_buckets():
+    history = ptphistory.History(capacity=100, interval=1)
+    fill(history, 150)
+    series = history.snapshot(buckets=10)["series"]
+    assert len(series["time"]) == 10
+    assert series["time"][0] == 1050.0
+    offsets = series["offset"]
+    for low, high, mean in zip(offsets["min"], offsets["max"], offsets["mean"]):
+        assert low <= mean <= high
+
+
+def test_empty_history():
+    snapshot = ptphistory.History(capacity=10).snapshot()
+    assert snapshot["sample_count"] == 0
+    assert snapshot["statistics"]["offset"] is None
+    assert snapshot["adev"] == {} and snapshot["tdev"] == {}
@@ -0,0 +1,121 @@
+import pytest
+
+import fakeptp4l
+import ptpmgmt
+
+
+@pytest.fixture
+def ptp4l(tmp_path):
+    server = fakeptp4l.FakePtp4l(str(tmp_path / "ptp4l"))
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def client(ptp4l, tmp_path):
+    client = ptpmgmt.ManagementClient(ptp4l.path)
+    client.client_path = str(tmp_path / "pmc-py")
+    yield client
+    client.close()
+
+
+def test_time_status(client):
+    status = client.time_status()
+    assert status.master_offset == -12
+    assert status.ingress_time == 1_700_000_000_123_456_789
+    assert status.gm_present
+    assert status.gm_identity == "001122.fffe.334455"
+    assert status.source == ptpmgmt.PortIdentity("b827eb.fffe.123456", 1)
+
+
+def test_connection_is_reused(client, ptp4l):
+    for _ in range(3):
+        assert client.time_status()
+    assert ptp4l.requests == 3
+    sock = client.sock
+    client.time_status()
+    assert client.sock is sock
+
+
+def test_clock_descriptions(client):
+    (description,) = client.clock_descriptions(wait=0.05)
+    assert description.physical_layer_protocol == "IEEE 802.3"
+    assert description.physical_address == "b8:27:eb:12:34:56"
+    assert description.protocol_address == b"\x0a\x00\x00\x01"
+    assert description.manufacturer_identity == "b8:27:eb"
+    assert description.product_description == "Raspberry;ptp4l;1"
+    assert description.revision_data == "1.0;2.0;3.0"
+    assert description.user_description == ""
+
+
+def test_port_data_sets(client):
+    (port,) = client.port_data_sets(wait=0.05)
+    assert port.port_identity == ptpmgmt.PortIdentity("b827eb.fffe.123456", 1)
+    assert port.port_state == "SLAVE"
+    assert port.peer_mean_path_delay == 5 << 16
+    assert port.log_announce_interval == 1
+    assert port.log_sync_interval == 0
+
+
+def test_set_priority1(client):
+    assert client.set_priority1(0) == 0
+
+
+def test_error_status_is_no_answer(client, ptp4l):
+    del ptp4l.data_sets[fakeptp4l.TIME_STATUS_NP]
+    assert client.time_status() is None
+
+
+def test_silent_ptp4l_times_out(client, ptp4l):
+    ptp4l.silent = True
+    assert client.time_status() is None
+    ptp4l.silent = False
+    assert client.time_status().master_offset == -12
+
+
+def test_notifications(client, ptp4l):
+    assert client.subscribe(
+        (ptpmgmt.NOTIFY_PORT_STATE, ptpmgmt.NOTIFY_TIME_SYNC), duration=60
+    )
+    ((duration, bitmask),) = ptp4l.subscribers.values()
+    assert duration == 60
+    assert bitmask[0] == 0b011 and not any(bitmask[1:])
+
+    ptp4l.notify(fakeptp4l.PORT_DATA_SET, fakeptp4l.port_data_set(6))
+    ptp4l.notify(fakeptp4l.PRIORITY1, b"\x80\x00")  # not a notification
+    ptp4l.notify(fakeptp4l.TIME_STATUS_NP, fakeptp4l.time_status(3, 10, False))
+    ptp4l.notify(
+        fakeptp4l.PARENT_DATA_SET, fakeptp4l.parent_data_set(priority1=0, priority2=7)
+    )
+
+    port = client.notification(0.5)
+    assert isinstance(port, ptpmgmt.PortDataSet) and port.port_state == "MASTER"
+    status = client.notification(0.5)
+    assert isinstance(status, ptpmgmt.TimeStatus)
+    assert (status.master_offset, status.ingress_time, status.gm_present) == (
+        3,
+        10,
+        False,
+    )
+    parent = client.notification(0.5)
+    assert isinstance(parent, ptpmgmt.ParentDataSet)
+    assert parent.grandmaster_identity == "001122.fffe.334455"
+    assert (parent.grandmaster_priority1, parent.grandmaster_priority2) == (0, 7)
+    assert (parent.grandmaster_clock_class, parent.grandmaster_clock_accuracy) == (
+        6,
+        0x21,
+    )
+    assert client.notification(0.05) is None
+
+
+def test_malformed_notification_is_skipped(client, ptp4l):
+    assert client.subscribe((ptpmgmt.NOTIFY_TIME_SYNC,), duration=60)
+    ptp4l.notify(fakeptp4l.TIME_STATUS_NP, b"\x00" * 6)
+    ptp4l.notify(fakeptp4l.TIME_STATUS_NP, fakeptp4l.time_status(1, 2))
+    assert client.notification(0.5).master_offset == 1
+
+
+def test_unpack_ignores_other_messages(client):
+    assert client.unpack(b"\x00" * 10) is None
+    # a GET request, not a response
+    assert client.unpack(client.build(ptpmgmt.GET, ptpmgmt.TIME_STATUS_NP)) is None